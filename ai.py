@@ -15,28 +15,85 @@
 # You should have received a copy of the GNU General Public License
 # along with CBGElite.  If not, see <http://www.gnu.org/licenses/>.
 
-import asyncio
 import random
+from math import ceil
 
 random.seed()
 
+# Timer wheel that runs the ship AIs and anything else waiting in game time,
+# one tick per frame. decide() returns the seconds until the next call, or
+# None when done, then finish() is called.
+class AiScheduler:
+	TICK = 0.04 # Seconds per tick, one frame
+	SLOTS = 64
+
+	def __init__(self, tick=TICK, slots=SLOTS):
+		self.tick_len = tick
+		self.wheel = [[] for i in range(slots)]
+		self.ticks = 0
+		self.count = 0
+
+	def _insert(self, due, agent):
+		# Due time is kept in seconds, so delays that are no multiple of
+		# the tick still average out right.
+		t = max(self.ticks + 1, ceil(due / self.tick_len - 1e-9))
+		self.wheel[t % len(self.wheel)].append((t, due, agent))
+
+	def add(self, agent, delay):
+		self.count += 1
+		self._insert(self.ticks * self.tick_len + delay, agent)
+
+	def run(self, gen, delay=0.0):
+		# Run a generator as an agent, see TickTask.
+		self.add(TickTask(gen), delay)
+
+	def tick(self):
+		self.ticks += 1
+		idx = self.ticks % len(self.wheel)
+		slot = self.wheel[idx]
+		if not slot:
+			return
+		now = self.ticks
+		self.wheel[idx] = [e for e in slot if e[0] > now]
+		for t, due, agent in slot:
+			if t > now:
+				continue
+			delay = agent.decide()
+			if delay is None:
+				self.count -= 1
+				agent.finish()
+			else:
+				self._insert(due + delay, agent)
+
+class TickTask:
+	# Game logic that waits in game time: the generator yields the delay
+	# in seconds until it goes on, like an asyncio.sleep() on the ticks.
+	def __init__(self, gen):
+		self.gen = gen
+
+	def decide(self):
+		return next(self.gen, None)
+
+	def finish(self):
+		pass
+
 class BaseAi:
 	MOVE_AWAY = 0
 	MOVE_RANDOM = 1
 	MOVE_TO = 2
+	INTERVAL = 0.1 # Seconds between decisions
 	def __init__(self, obj):
 		self.obj = obj
 		self.g3d = obj.g3d
 		self.cbg = obj.mv.cbg
-		self.loop = asyncio.get_event_loop()
-		self.task = self.loop.create_task(self.task())
 		self.max_speed = obj.ship.opt_max_speed / 2
 		self.speed = self.max_speed / 2
 		self.roll = 0.0
 		self.randpitch = 0.0
 		self.strat = self.MOVE_TO
 		self.dn = 0.0
-		self.task.add_done_callback(lambda fut: fut.result())
+		self.ts = 0
+		obj.mv.ai_scheduler.add(self, self.INTERVAL)
 
 	def handle(self):
 		o = self.obj
@@ -74,8 +131,11 @@ class BaseAi:
 		if r or p:
 			o.local_roll_pitch(r, p)
 
-	async def _movement_strategy(self, x, ts):
+	# The strategies return the extra delay in seconds before the next
+	# decision.
+	def _movement_strategy(self, x):
 		o = self.obj
+		ts = self.ts
 		if x > 0.9:
 			self.roll = 0.02
 		elif x < 0.1:
@@ -103,13 +163,14 @@ class BaseAi:
 			self.strat = self.MOVE_RANDOM
 			speed = self.max_speed * 0.85
 			ts = 0
+		self.ts = ts
 		if self.strat is self.MOVE_RANDOM:
 			self.roll = random.uniform(-0.06, 0.06)
 			self.randpitch = random.uniform(-0.06, 0.06)
-			await asyncio.sleep(0.2)
-		return ts
+			return 0.2
+		return 0.0
 
-	async def _shooting_strategy(self, x, ts):
+	def _shooting_strategy(self, x):
 		o = self.obj
 		if self.dn > 0.975 and o.distance < 30000:
 			if x < 0.3 and o.angry:
@@ -117,23 +178,26 @@ class BaseAi:
 		elif self.dn > 0.95 and o.distance < 25000:
 			if x < 0.2 and o.angry:
 				o.shoot(False)
-		return ts
+		return 0.0
 
-	async def _missile_strategy(self, x, ts):
+	def _missile_strategy(self, x):
 		o = self.obj
 		if o.angry and o.missiles and o.energy < (o.ship.opt_max_energy / 2):
 			if x < (0.03 * o.missiles):
 				o.launch_missile()
-		return ts
+		return 0.0
+
+	def decide(self):
+		if not self.obj.alive or self.obj.ai is not self:
+			return None
+		x = random.random()
+		delay = self._movement_strategy(x)
+		delay += self._shooting_strategy(x)
+		delay += self._missile_strategy(x)
+		return self.INTERVAL + delay
 
-	async def task(self):
-		ts = 0
-		while self.obj.alive:
-			await asyncio.sleep(0.1)
-			x = random.random()
-			ts = await self._movement_strategy(x, ts)
-			ts = await self._shooting_strategy(x, ts)
-			ts = await self._missile_strategy(x, ts)
+	def finish(self):
+		pass
 
 class CanisterAi:
 	def __init__(self, obj):
@@ -232,14 +296,13 @@ class ThargoidAi(BaseAi):
 		super().__init__(obj)
 		self.thargons = []
 
-	async def _missile_strategy(self, x, ts):
+	def _missile_strategy(self, x):
 		o = self.obj
 		if o.energy < (o.ship.opt_max_energy / 2) and x < 0.12 and o.missiles:
 			self.thargons.append(o.launch_missile("thargon", ThargonAi))
-		return ts
+		return 0.0
 
-	async def task(self):
-		await super().task()
+	def finish(self):
 		for t in self.thargons:
 			t.ai.aimless = True
 
@@ -248,17 +311,15 @@ class ThargonAi(BaseAi):
 		super().__init__(obj)
 		self.aimless = False
 
-	async def _movement_strategy(self, x, ts):
+	def _movement_strategy(self, x):
 		if self.aimless:
 			self.speed = 1
 			self.strat = self.MOVE_RANDOM
 			self.randpitch = 0
-			await asyncio.sleep(1)
-			return ts
-		return await super()._movement_strategy(x, ts)
+			return 1.0
+		return super()._movement_strategy(x)
 
-	async def _shooting_strategy(self, x, ts):
+	def _shooting_strategy(self, x):
 		if self.aimless:
-			await asyncio.sleep(1)
-			return ts
-		return await super()._shooting_strategy(x, ts)
+			return 1.0
+		return super()._shooting_strategy(x)
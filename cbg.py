@@ -32,9 +32,14 @@ from quaternion import *
 from screendiff import ScreenDiff
 
 class CBG(ScreenDiff):
-	def __init__(self, showfps=False):
+	def __init__(self, showfps=False, headless=False):
 		self.bitmasks = ((1, 8), (2, 16), (4, 32), (64, 128))
-		self.cheight, self.cwidth = (int(x) for x in os.popen('stty size', 'r').read().split())
+		self.headless = headless
+		if headless:
+			# No terminal attached, render into a fixed size screen.
+			self.cheight, self.cwidth = 60, 160
+		else:
+			self.cheight, self.cwidth = (int(x) for x in os.popen('stty size', 'r').read().split())
 		self.curx = 5
 		self.cury = 5
 		self.putcursor(0, 0)
@@ -47,7 +52,8 @@ class CBG(ScreenDiff):
 		self.setclip()
 		self.clearcolormap()
 		self.clearscreen()
-		print("\x1b[2J", end="")
+		if not headless:
+			print("\x1b[2J", end="")
 		self.font = FontData("chargen.rom")
 		self.font.optimize(self.bitmasks)
 		self.orig_sigint = signal.getsignal(signal.SIGINT)
@@ -74,7 +80,7 @@ class CBG(ScreenDiff):
 			self.log(" ")
 
 	def log(self, *args):
-		if not self.log_h:
+		if not self.log_h or self.headless:
 			return
 		s = " ".join(str(a) for a in args)
 		s = s.ljust(self.cwidth-1, " ")
@@ -84,18 +90,24 @@ class CBG(ScreenDiff):
 			print(l, end='')
 
 	def enable_cursor(self):
-		print("\x1b[?25h", end='')
+		if not self.headless:
+			print("\x1b[?25h", end='')
 
 	def disable_cursor(self):
-		print("\x1b[?25l", end='')
+		if not self.headless:
+			print("\x1b[?25l", end='')
 
 	def disable_echo(self):
+		if self.headless:
+			return
 		fd = sys.stdin.fileno() # Well.. this is 0, right?
 		flags = termios.tcgetattr(fd)
 		flags[3] &= ~termios.ECHO
 		termios.tcsetattr(fd, termios.TCSANOW, flags)
 
 	def enable_echo(self):
+		if self.headless:
+			return
 		fd = sys.stdin.fileno()
 		flags = termios.tcgetattr(fd)
 		flags[3] |= termios.ECHO
@@ -104,8 +116,9 @@ class CBG(ScreenDiff):
 	def exit(self, retcode):
 		self.enable_cursor()
 		self.enable_echo()
-		self.putcursor(0, self.cheight+self.log_h-1)
-		print("\x1b[0m")
+		if not self.headless:
+			self.putcursor(0, self.cheight+self.log_h-1)
+			print("\x1b[0m")
 		print("Screen size: {}x{}".format(self.width, self.height))
 		print("Screen Char size: {}x{}".format(self.cwidth, self.cheight))
 		sys.exit(retcode)
@@ -134,8 +147,20 @@ class CBG(ScreenDiff):
 		self.clearmap()
 		self.redraw_screen()
 
+	def redraw_screen(self):
+		# Headless there is no terminal, so nothing is drawn. The soak
+		# statistics then only measure the game itself.
+		if self.headless:
+			return 0
+		return super().redraw_screen()
+
+	def full_redraw_screen(self):
+		if self.headless:
+			return 0
+		return super().full_redraw_screen()
+
 	def putcursor(self, x, y):
-		if self.cury == y and  self.curx == x:
+		if self.headless or (self.cury == y and self.curx == x):
 			return
 		print("\x1b[{};{}H".format(int(y)+1, int(x)+1), end='')
 		self.curx = x
@@ -170,22 +195,37 @@ class CBG(ScreenDiff):
 		idx = cpx + cpy * self.cwidth
 		self.map[idx] ^= bmp
 
+	def putrow(self, buf, idx, row):
+		# Copy a row of character cells into buf, clipped to the buffer
+		# boundaries. Never change the size of buf!
+		end = idx + len(row)
+		if idx < 0 or end > len(buf):
+			i0 = max(idx, 0)
+			i1 = min(end, len(buf))
+			if i0 >= i1:
+				return
+			row = row[i0-idx:i1-idx]
+			idx = i0
+			end = i1
+		buf[idx:end] = row
+
 	def drawglyph(self, x, y, char):
 		self.drawcustomglyph(x, y, self.font.getchar(char))
 
 	def drawcustomglyph(self, x, y, data):
-		x = int(x / 2)
-		y = int(y / 4)
-		for r in range(2):
-			for c in range(4):
-				self.putcode(x + c, y + r, data[r*4+c])
+		idx = int(x / 2) + int(y / 4) * self.cwidth
+		self.putrow(self.map, idx, data[:4])
+		self.putrow(self.map, idx + self.cwidth, data[4:8])
 
 	def drawtext(self, x, y, s, fg=None, bg=None):
-		for c in s:
-			self.drawglyph(x, y, c)
-			if fg or bg:
-				self.colorrect(x, y, 8, 8, fg, bg)
-			x += 8
+		if not s:
+			return
+		row0, row1 = self.font.getrun(s)
+		idx = int(x / 2) + int(y / 4) * self.cwidth
+		self.putrow(self.map, idx, row0)
+		self.putrow(self.map, idx + self.cwidth, row1)
+		if fg or bg:
+			self.colorrect(x, y, 8 * len(s), 8, fg, bg)
 
 	def colorrect(self, x, y, w, h, fg, bg):
 		x = int(x / 2)
@@ -206,11 +246,10 @@ class CBG(ScreenDiff):
 				for j in range(x, x+w):
 					self.colormap[idx + j] &= msk
 					self.colormap[idx + j] |= c
-		else:
+		elif w > 0:
+			row = bytes((c,)) * w
 			for i in range(y, y+h):
-				idx = i * self.cwidth
-				for j in range(x, x+w):
-					self.colormap[idx + j] = c
+				self.putrow(self.colormap, i * self.cwidth + x, row)
 
 	def line(self, x0, y0, x1, y1, mode=0, pattern=None):
 		self.set_putpixel(mode)
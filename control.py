@@ -15,8 +15,9 @@
 # You should have received a copy of the GNU General Public License
 # along with CBGElite.  If not, see <http://www.gnu.org/licenses/>.
 
-from evdev import Input, find_devices
+from evdev import InputManager
 from time import sleep
+import asyncio
 import json
 
 class BaseDev:
@@ -44,6 +45,7 @@ class BaseDev:
 		self.btns0 = set()
 		self.keys = set()
 		self.keys0 = set()
+		self.ready = None
 		self.keymap = {} # FIMXE
 		self.joymap = {
 				288: self.BTN_FIRE,
@@ -66,6 +68,31 @@ class BaseDev:
 	def handle(self):
 		pass
 
+	def get_inputs(self):
+		return []
+
+	def attach(self, loop):
+		# From now on, input devices are read by the event loop.
+		self.ready = asyncio.Event()
+		for i in self.get_inputs():
+			i.attach(loop, self.ready.set)
+
+	def is_active(self):
+		# Anything held down or deflected that should keep screens updating
+		return bool(self.btns or self.keys) or abs(self.roll) >= 0.01 or abs(self.pitch) >= 0.01
+
+	async def wait_input(self, timeout=None):
+		# Sleep until input events arrived since the last call, or the
+		# timeout expires.
+		if self.ready is None:
+			return
+		if not self.ready.is_set():
+			try:
+				await asyncio.wait_for(self.ready.wait(), timeout)
+			except asyncio.TimeoutError:
+				pass
+		self.ready.clear()
+
 	def get_roll(self):
 		return self.roll
 
@@ -99,6 +126,7 @@ class Joydev(BaseDev):
 		self.axis_center = {}
 		self.axis_max = {}
 		self.axis_min = {}
+		self.axis_norm = {}
 		self.deadz = 15
 		self.ascale = (100.0 + self.deadz) / 100.0
 		self.throttle_axis = None
@@ -110,11 +138,15 @@ class Joydev(BaseDev):
 			self.handle()
 			sleep(0.05)
 		self.axis_center = {i:v for i,v in self.axis.items()}
+		self.axis_norm.clear()
 		# FIXME: Calibrate max and min also?
 
 	def set_throttle_axis(self, axis):
 		self.throttle_axis = axis
 
+	def get_inputs(self):
+		return [self.jdev, self.kdev]
+
 	def _normalize(self, axis, index):
 		mid = self.axis_center.get(index, 128)
 		raw = axis[index] - mid
@@ -125,6 +157,12 @@ class Joydev(BaseDev):
 		ret = min(max(ret * self.ascale, -100), 100)
 		return ret / 100.0
 
+	def _get_axis(self, index, changed):
+		# Only normalize axis values that changed since the last frame.
+		if index in changed or index not in self.axis_norm:
+			self.axis_norm[index] = -self._normalize(self.axis, index)
+		return self.axis_norm[index]
+
 	def _lpfilter(self, old, new):
 		return (old * 0.8 + new * 0.2)
 
@@ -135,10 +173,15 @@ class Joydev(BaseDev):
 			if k in self.keymap:
 				self.btns.add(self.keymap[k])
 		self.axis = axis = self.jdev.axis
+		changed = self.jdev.changed_axes()
 		if 0 in axis:
-			self.roll = self._lpfilter(self.roll, -self._normalize(axis, 0))
+			self.roll = self._lpfilter(self.roll, self._get_axis(0, changed))
+		else: # Joystick unplugged
+			self.roll = self._lpfilter(self.roll, 0.0)
 		if 1 in axis:
-			self.pitch = self._lpfilter(self.pitch, -self._normalize(axis, 1))
+			self.pitch = self._lpfilter(self.pitch, self._get_axis(1, changed))
+		else:
+			self.pitch = self._lpfilter(self.pitch, 0.0)
 		if self.throttle_axis and self.throttle_axis in axis:
 			self.throttle = (255 - axis[self.throttle_axis]) / 255.0
 		else:
@@ -152,6 +195,9 @@ class Kbddev(BaseDev):
 		super().__init__()
 		self.kdev = kdev
 
+	def get_inputs(self):
+		return [self.kdev]
+
 	def handle(self):
 		self.keys = keys = self.kdev.keys_pressed()
 		self.btns = {self.keymap[x] for x in keys if x in self.keymap}
@@ -174,18 +220,11 @@ class Kbddev(BaseDev):
 
 class Control:
 	def __init__(self, cbg):
-		keyboard_dev, keyboard_name = find_devices()
-		joystick_dev, joystick_name = find_devices(joystick=True)
-
+		self.cbg = cbg
 		try:
-			if keyboard_dev:
-				self.keyboard = Input(keyboard_dev)
-			else:
-				self.keyboard = None
-			if joystick_dev:
-				self.joystick = Input(joystick_dev)
-			else:
-				self.joystick = None
+			self.inputs = InputManager()
+			self.keyboard = self.inputs.keyboards or None
+			self.joystick = self.inputs.joysticks or None
 		except PermissionError:
 			print("""
 There seems to be an issue with permissions, and I need your help.
@@ -211,6 +250,13 @@ extra priviledges. You basically have two choices to make this work:
 	def get_evdev(self):
 		return self.evdev
 
+	def watch_devices(self, loop):
+		# Pick up keyboards and joysticks that are plugged in later.
+		try:
+			self.inputs.watch(loop, log=self.cbg.log)
+		except OSError as e:
+			self.cbg.log("Input device hotplug not available:", e)
+
 	def get_yes_no(self):
 		while True:
 			k = self.keyboard.keys_pressed().copy()
@@ -25,12 +25,18 @@ import os
 import json
 from time import sleep, monotonic
 from math import sin, sqrt
-from microverse import Microverse
+from microverse import Microverse, soundfx
 from universe import Universe
-from market import Market
+from market import MarketSim, TradeAnalyzer, CargoLedger, PRICE_TABLE
 from ai import BaseAi, ThargoidAi
 from control import Control, BaseDev
+from evdev import KEY_ESC, KEY_BACKSPACE, KEY_ENTER, KEY_LETTERS
+from replay import InputRecorder, InputReplay
+from soak import SyntheticDev, SoakStats
+from route import RoutePlanner
 from collections import deque
+import savegame
+from savegame import SaveStore
 
 class BarGraph:
 	def __init__(self, cbg, x, y, w, h, fg, bg, ticks=0):
@@ -60,9 +66,11 @@ class BarGraph:
 		for i in range(self.ticks):
 			self.cbg.putpixel(self.x + i * ts, self.y + self.h - 1)
 
+	def draw_static(self):
+		self.draw_ticks()
+
 	def redraw(self):
 		self.cbg.fillrect(self.x, self.y + 2, int(self.value * self.w), self.h - 4)
-		self.draw_ticks()
 
 class Meter(BarGraph):
 	def __init__(self, cbg, x, y, w, h, fg, bg, ticks=0):
@@ -74,7 +82,6 @@ class Meter(BarGraph):
 		v = (self.value - self.minval) / (1.0 - self.minval)
 		xp = self.x + int(v * self.w)
 		self.cbg.line(xp, self.y + 2, xp, self.y + self.h - 3)
-		self.draw_ticks()
 
 class Battery:
 	def __init__(self, cbg, x, y, bw, bh):
@@ -93,6 +100,9 @@ class Battery:
 			vb = v * 4.0 - (3.0 - i)
 			self.bars[i].set_value(vb)
 
+	def draw_static(self):
+		pass
+
 	def redraw(self):
 		for b in self.bars:
 			b.redraw()
@@ -127,7 +137,6 @@ class Radar:
 		cy = self.srady + self.sradh // 2
 		a = self.sradw
 		b = self.sradh
-		self.cbg.ellipse(cx, cy, a, b)
 		m = self.cockpit.m
 		if not m.planet:
 			px, py, pz = (0, 0, 1000)
@@ -160,13 +169,13 @@ class Radar:
 		else:
 			self.cbg.rect(pxr, pyr, 2, 2)
 
-	def redraw(self):
+	def draw_static(self):
 		cx = self.cx
 		cy = self.cy
 		a = self.rradx * 2
 		b = self.rrady * 2
 		self.cbg.ellipse(cx, cy, a, b)
-		self.redraw_srad()
+		self.cbg.ellipse(self.sradx + self.sradw // 2, self.srady + self.sradh // 2, self.sradw, self.sradh)
 		self.cbg.line(cx, cy + b // 2, cx, cy - b // 2, pattern=0xaaaa)
 		self.cbg.line(cx - a // 2, cy - 2, cx + a // 2, cy - 2, pattern=0x8888)
 		self.cbg.line(cx - a // 2 + 14, cy - b // 4 - 3, cx + a // 2 - 14, cy - b // 4 - 3, pattern=0x8888)
@@ -175,6 +184,9 @@ class Radar:
 		self.cbg.line(cx + int(a/6.5), cy - b // 2 + 2, cx + int(a/2.5), cy + b // 2 - 9, pattern=0xaaaa)
 		self.cbg.line(cx - int(a/6.5), cy - b // 2 + 2, cx, cy - 3, pattern=0x8888)
 		self.cbg.line(cx + int(a/6.5), cy - b // 2 + 2, cx, cy - 3, pattern=0x8888)
+
+	def redraw(self):
+		self.redraw_srad()
 		self.redraw_objects()
 
 	def redraw_objects(self):
@@ -382,17 +394,44 @@ class BaseScreen:
 	def exit(self):
 		pass
 
+	def is_idle(self, inp):
+		return False
+
 class MenuScreen(BaseScreen):
 	TITLE = "Base Menu"
 	def __init__(self, elite, cbg):
 		super().__init__(elite, cbg)
 		self.tx = self.width // 2 - len(self.TITLE) * 4
+		self.dirty = True
+		self.ts_draw = 0.0
+
+	def set_dirty(self):
+		self.dirty = True
+
+	def refresh_after(self, now, interval):
+		# Timer event, used when the game state can change without input,
+		# like when flying with a menu screen open.
+		if now - self.ts_draw >= interval:
+			self.dirty = True
+
+	def is_idle(self, inp):
+		return not self.dirty and not inp.is_active()
+
+	def handle_keys(self, nkeys):
+		pass
 
 	def handle(self, inp):
-		self.cbg.clearmap()
-		self.draw_background()
-		self.draw()
-		return inp.get_new_keys(), True
+		nkeys = inp.get_new_keys()
+		if nkeys:
+			self.dirty = True
+			self.handle_keys(nkeys)
+		if self.dirty:
+			self.cbg.clearmap()
+			self.draw_background()
+			self.draw()
+			self.dirty = False
+			self.ts_draw = self.elite.loop.time()
+		return nkeys, True
 
 	def draw_background(self):
 		super().draw_background()
@@ -457,8 +496,13 @@ class Cockpit(BaseScreen):
 		self.rlmeter.setup()
 		self.dcmeter.setup()
 		self.radar.setup()
+		self.cbg.clearmap()
+		self.draw_static()
+		self.cbg.store_static()
 
-	def draw_background(self):
+	def draw_static(self):
+		# Everything that does not change while flying. This is rendered
+		# only once into the static layer of the screen.
 		super().draw_background()
 		self.cbg.line(1, self.ystatus, self.width-1, self.ystatus)
 		self.cbg.line(self.sboxw, self.ystatus, self.sboxw, self.height-2)
@@ -470,20 +514,37 @@ class Cockpit(BaseScreen):
 			y = self.ystatus + 11 + i * 8
 			x2 = self.sboxw + self.radarw + 1
 			if i < 6:
-				getattr(self, "bar_"+self.bgnames[i].lower()).redraw()
-			elif i == 6:
-				for j in range(self.cd.missiles):
-					self.cbg.drawcustomglyph(24 + j * 10, y-5, self.missile_glyph)
+				getattr(self, "bar_"+self.bgnames[i].lower()).draw_static()
 			self.cbg.line(self.sboxw - bglen, y, self.sboxw, y)
 			self.cbg.line(x2, y, x2 + bglen, y)
 			self.cbg.drawtext(4, y-5, tl[i])
 			self.cbg.drawtext(self.width-20, y-5, tr[i])
+		self.battery.draw_static()
+		self.speedbar.draw_static()
+		self.rlmeter.draw_static()
+		self.dcmeter.draw_static()
+		self.radar.draw_static()
+
+	def draw_dynamic(self):
+		for i in range(6):
+			getattr(self, "bar_"+self.bgnames[i].lower()).redraw()
+		y = self.ystatus + 11 + 6 * 8
+		for j in range(self.cd.missiles):
+			self.cbg.drawcustomglyph(24 + j * 10, y-5, self.missile_glyph)
+		if self.cd.missiles:
+			# The glyphs overwrite whole cells, including the static line below.
+			bglen = 40
+			self.cbg.line(self.sboxw - bglen, y, self.sboxw, y)
 		self.battery.redraw()
 		self.speedbar.redraw()
 		self.rlmeter.redraw()
 		self.dcmeter.redraw()
 		self.radar.redraw()
 
+	def draw_background(self):
+		self.draw_static()
+		self.draw_dynamic()
+
 	def handle(self, inp):
 		m = self.m
 		nkeys = inp.get_new_keys()
@@ -523,8 +584,8 @@ class Cockpit(BaseScreen):
 		self.battery.set_value(m.energy)
 		self.bar_as.set_value(m.aft_shield)
 		self.bar_fs.set_value(m.front_shield)
-		self.cbg.clearmap()
-		self.draw_background()
+		self.cbg.restore_static()
+		self.draw_dynamic()
 		m.set_roll_pitch(roll, pitch)
 		self.cbg.setclip(self.spaceclip)
 		m.draw()
@@ -590,7 +651,7 @@ class Cockpit(BaseScreen):
 					continue
 				cbg.ellipse(xc, yc, int(r - xc), int(r - xc))
 			cbg.redraw_screen()
-			await asyncio.sleep(0.03)
+			await self.elite.idle(asyncio.sleep(0.03))
 			dz -= acc
 			acc += 0.1
 		cbg.setclip(None)
@@ -636,7 +697,7 @@ class Cockpit(BaseScreen):
 			alpha += roll
 			if zp < 800:
 				zp += 10
-			await asyncio.sleep(0.01)
+			await self.elite.idle(asyncio.sleep(0.01))
 		cbg.setclip(None)
 
 	async def hyperspace_animation_end(self):
@@ -671,12 +732,14 @@ class Cockpit(BaseScreen):
 				c.draw(pats[t])
 			cbg.redraw_screen()
 			i += 1
-			await asyncio.sleep(0.01)
+			await self.elite.idle(asyncio.sleep(0.01))
 		cbg.setclip(None)
 
 class Chooser:
-	def __init__(self, cbg, items, x, y, fstr):
+	def __init__(self, cbg, items, x, y, fstr, rows=None):
 		self.items = items
+		self.rows = rows # Scroll if there are more items than this
+		self.top = 0
 		self.x = x
 		self.y = y
 		self.fstr = fstr
@@ -702,16 +765,38 @@ class Chooser:
 	def draw_list(self):
 		y = self.y
 		i = 0
+		top, bottom = self.get_window()
 		for num, item in enumerate(self.items):
-			self.draw_item(y, item, num, (i==self.index))
+			if top <= num < bottom:
+				self.draw_item(y, item, num, (i==self.index))
+				y += 8
 			if item[0]:
 				i += 1
-			y += 8
+		if top > 0:
+			self.cbg.drawtext(self.x - 8, self.y, "^")
+		if bottom < len(self.items):
+			self.cbg.drawtext(self.x - 8, y - 8, "v")
 		return y
 
+	def get_window(self):
+		# Range of items shown, kept around the selected item.
+		if self.rows is None or len(self.items) <= self.rows:
+			return 0, len(self.items)
+		active = [num for num, item in enumerate(self.items) if item[0]]
+		if active:
+			sel = active[min(self.index, len(active) - 1)]
+			if sel < self.top:
+				self.top = sel
+			elif sel >= self.top + self.rows:
+				self.top = sel - self.rows + 1
+		self.top = min(self.top, len(self.items) - self.rows)
+		return self.top, self.top + self.rows
+
 	def handle(self, incr):
+		index = self.index
 		self.indexf = min(max(self.indexf + incr, 0.0), self.index_max * 4.0 - 1.0)
 		self.index = int(self.indexf / 4)
+		return self.index != index
 
 class EquipShip(MenuScreen):
 	TITLE = "EQUIP SHIP"
@@ -807,11 +892,14 @@ class EquipShip(MenuScreen):
 
 	def handle(self, inp):
 		if self.menulevel == 0:
-			self.itemchooser.handle(-inp.get_pitch())
+			if self.itemchooser.handle(-inp.get_pitch()):
+				self.set_dirty()
 		elif self.menulevel == 1:
-			self.laserchooser.handle(-inp.get_pitch())
+			if self.laserchooser.handle(-inp.get_pitch()):
+				self.set_dirty()
 		nbtn = inp.get_new_buttons()
 		if BaseDev.BTN_FIRE in nbtn:
+			self.set_dirty()
 			if self.menulevel == 0:
 				tag = self.itemchooser.selected[1]
 				if "laser" in tag:
@@ -837,24 +925,94 @@ class EquipShip(MenuScreen):
 
 class GalaxyMap(MenuScreen):
 	TITLE = "GALACTIC CHART"
+	KEY_SEARCH = 33 # F
+	KEY_ROUTE_MODE = 19 # R
 	def __init__(self, elite, cbg, cd):
 		super().__init__(elite, cbg)
 		self.cd = cd
 		self.galaxy = cd.galaxy
+		self.search = None # Search text, while searching
+		self.matches = []
 		self.setup_screen()
 
+	def handle_keys(self, nkeys):
+		if self.search is None:
+			if self.KEY_SEARCH in nkeys:
+				self.search = ""
+				self.matches = []
+			elif self.KEY_ROUTE_MODE in nkeys:
+				self.elite.routes.toggle_mode()
+			return
+		for k in nkeys:
+			if k in KEY_LETTERS:
+				self.search += KEY_LETTERS[k]
+			elif k == KEY_BACKSPACE:
+				self.search = self.search[:-1]
+			elif k == KEY_ENTER:
+				if self.matches:
+					self.select(self.matches[0][1])
+				self.search = None
+				return
+			elif k == KEY_ESC:
+				self.search = None
+				return
+		if self.search:
+			self.matches = self.universe.find_systems(self.search, self.galaxy)
+		else:
+			self.matches = []
+
+	def select(self, idx):
+		self.cd.target = idx
+
+	def is_visible(self, x, y):
+		return True
+
+	def draw_route(self):
+		# Planned route from the current system to the target
+		cd = self.cd
+		if cd.target == cd.system:
+			return
+		routes = self.elite.routes
+		route = routes.route(self.galaxy, cd.system, cd.target)
+		if route is None:
+			self.cbg.drawtext(16, 224, "NO ROUTE")
+			return
+		coords = self.universe.get_coords(self.galaxy)
+		pts = [self._coord(*coords[i]) for i in route]
+		for p0, p1 in zip(pts, pts[1:]):
+			if self.is_visible(*p0) and self.is_visible(*p1):
+				self.cbg.line(*p0, *p1)
+		self.cbg.drawtext(16, 224, "ROUTE: {} JUMPS {:.1f} LY ({})".format(
+				len(route) - 1, routes.route_distance(self.galaxy, route), routes.mode.upper()))
+
+	def draw_search(self):
+		if self.search is None:
+			return
+		c = self.cbg
+		c.drawtext(16, 200, "FIND: " + self.search.upper() + "_")
+		names = [self.universe.get_system_by_index(self.galaxy, i).name for g, i in self.matches[:4]]
+		if names:
+			c.drawtext(16, 212, " ".join(names)[:36])
+			x, y = self.get_position(self.universe.get_system_by_index(self.galaxy, self.matches[0][1]))
+			if self.is_visible(x, y):
+				c.rect(x - 3, y - 3, 7, 7)
+
+	def _coord(self, x, y):
+		return x + 32, (y >> 1) + 32
+
 	def get_position(self, s):
-		return s.x + 32, (s.y >> 1) + 32
+		return self._coord(s.x, s.y)
 
 	def draw(self):
 		tsys = self.cd.system
 		self.cbg.drawtext(self.width-32, 8, "{}/8".format(self.galaxy + 1))
-		for i in range(256):
-			s = self.universe.get_system_by_index(self.galaxy, i)
-			self.cbg.putpixel(*self.get_position(s))
+		for x, y in self.universe.get_coords(self.galaxy):
+			self.cbg.putpixel(*self._coord(x, y))
 		s = self.universe.get_system_by_index(self.galaxy, tsys)
 		r = int(self.cd.fuel * 5)
 		self.cbg.ellipse(*self.get_position(s), r, r)
+		self.draw_route()
+		self.draw_search()
 
 class ShortRangeMap(GalaxyMap):
 	TITLE = "SHORT RANGE CHART"
@@ -867,36 +1025,56 @@ class ShortRangeMap(GalaxyMap):
 		self.cy = s.y
 		self.curx = st.x
 		self.cury = st.y
+		self.cursor_moved = True
 		self.setup_screen()
 
+	def is_visible(self, x, y):
+		return 64 < x < 256 and 32 < y < 182
+
+	def select(self, idx):
+		super().select(idx)
+		s = self.universe.get_system_by_index(self.galaxy, idx)
+		if self.is_visible(*self.get_position(s)):
+			self.curx = s.x
+			self.cury = s.y
+		# Don't let the cursor override the selected target on exit
+		self.cursor_moved = False
+
 	def _coord(self, x, y):
 		x = int((x - self.cx) * 4 + 160)
 		y = int((y - self.cy) * 2 + 100)
 		return x, y
 
-	def get_position(self, s):
-		return self._coord(s.x, s.y)
-
 	def handle(self, inp):
+		if self.search is not None:
+			# Keys are used for typing now
+			return super().handle(inp)
 		dx = -inp.get_roll()
 		dy = -inp.get_pitch()
 		x, y = self._coord(self.curx + dx, self.cury + dy)
-		if 64 < x < 256:
+		if 64 < x < 256 and dx:
 			self.curx += dx
-		if 32 < y < 182:
+			self.cursor_moved = True
+			self.set_dirty()
+		if 32 < y < 182 and dy:
 			self.cury += dy
+			self.cursor_moved = True
+			self.set_dirty()
 		return super().handle(inp)
 
 	def exit(self):
-		st = self.universe.get_system_near(self.cd.galaxy, self.curx, self.cury)
-		if st:
-			self.cd.target = st.index
+		if self.cursor_moved:
+			st = self.universe.get_system_near(self.cd.galaxy, self.curx, self.cury)
+			if st:
+				self.cd.target = st.index
 		return super().exit()
 
 	def draw(self):
 		texty = set()
-		for i in range(256):
-			s = self.universe.get_system_by_index(self.galaxy, i)
+		# Only systems in the visible part of the chart
+		visible = self.universe.get_systems_in_rect(self.galaxy,
+				self.cx - 24, self.cy - 34, self.cx + 24, self.cy + 41)
+		for s in visible:
 			x, y = self.get_position(s)
 			if 64 < x < 256 and 32 < y < 182:
 				r = s.radius // 1024
@@ -915,6 +1093,8 @@ class ShortRangeMap(GalaxyMap):
 		curx, cury = self._coord(self.curx, self.cury)
 		self.cbg.line(curx, cury - 8, curx, cury + 8, mode=2)
 		self.cbg.line(curx - 8, cury, curx + 8, cury, mode=2)
+		self.draw_route()
+		self.draw_search()
 
 class MarketPrices(MenuScreen):
 	def __init__(self, elite, cbg, cd):
@@ -935,33 +1115,41 @@ class MarketPrices(MenuScreen):
 			c.drawtext(16, y, "{:12s} {:2s} {:5.2f}   {:2d}{}".format(name, unit, price, stock, unit))
 			y += 8
 
+class TradeRoutes(MenuScreen):
+	TITLE = "TRADE ROUTES"
+	def __init__(self, elite, cbg, cd):
+		super().__init__(elite, cbg)
+		self.cd = cd
+		self.routes = elite.trade_analyzer.get_best(cd.galaxy, cd.system, 16)
+		self.setup_screen()
+
+	def draw(self):
+		c = self.cbg
+		u = self.universe
+		names = self.elite.market.price_table
+		c.drawtext(16, 32, "EXPECTED PROFITS WITHIN {} JUMPS".format(self.elite.trade_analyzer.maxjumps))
+		c.drawtext(16, 48, "PRODUCT      SELL AT   JMP PROFIT")
+		y = 64
+		for profit, item, dst, jumps in self.routes:
+			name, _, _, unit = names[item][:4]
+			s = u.get_system_by_index(self.cd.galaxy, dst)
+			c.drawtext(16, y, "{:12s} {:9s}  {:d}  {:5.2f}/{}".format(name, s.name, jumps, profit, unit))
+			y += 8
+
 class MarketBuy(MenuScreen):
 	TITLE = "BUY/SELL ITEMS"
 	def __init__(self, elite, cbg, cd):
 		super().__init__(elite, cbg)
 		self.cd = cd
+		self.commander = elite.commander
+		self.ledger = self.commander.cargo
 		lst = []
 		for i, item in enumerate(cd.current_market):
-			key = str(i) # JSon object keys must be strings
-			if key in cd.cargo and cd.cargo[key] > 0:
-				inv = str(cd.cargo[key]) + item[3]
-			else:
-				inv = "-"
-			lst.append([*item, inv])
+			lst.append([*item, self.ledger.get_text(i)])
 		self.market = lst
 		self.chooser = Chooser(cbg, self.market, 16, 56, "{1:12s} {4:2s} {2:5.2f}  {3:2d}{4:2s}     {5:3s}")
 		self.setup_screen()
 
-	def exit(self):
-		for i, (name, price, stock, unit, inv) in enumerate(self.market):
-			inv = self.parse_inv(i)
-			key = str(i) # JSon object keys must be strings
-			if inv > 0:
-				self.cd.cargo[key] = inv
-			elif key in self.cd.cargo:
-				del self.cd.cargo[key]
-		return super().exit()
-
 	def draw(self):
 		c = self.cbg
 		cd = self.cd
@@ -970,56 +1158,40 @@ class MarketBuy(MenuScreen):
 		c.colorrect(16, 32, 256, 160, 15, 0)
 		self.chooser.draw_list()
 
-	def parse_inv(self, i):
-		inv = self.market[i][-1]
-		if inv == "-":
-			return 0
-		return int(inv.strip("tkg"))
-
-	def get_total_inv(self):
-		inv = 0
-		for i in range(len(self.market)):
-			if self.market[i][3] != "t":
-				continue
-			inv += self.parse_inv(i)
-		return inv
-
 	def try_buy(self, i, name, price, stock, unit, inv):
-		maxcargo = 35 if self.cd.cargo_bay else 20
-		inv = self.parse_inv(i)
-		tinv = self.get_total_inv()
-		if tinv >= maxcargo and unit == "t":
+		if unit == "t" and self.commander.get_free_cargo_space() < 1:
 			return False
-		if price > self.cd.bitcoin:
+		if self.elite.quote(i, 1) > self.cd.bitcoin:
 			return False
 		if stock <= 0:
 			return False
-		inv = str(inv+1) + unit
+		self.ledger.add(i)
+		_, price, stock, _ = self.elite.trade(i, 1)
 		self.cd.bitcoin -= price
-		self.cd.current_market[i][2] = stock - 1
-		self.market[i][2] = stock - 1
-		self.market[i][4] = inv
+		self.market[i][1] = price
+		self.market[i][2] = stock
+		self.market[i][4] = self.ledger.get_text(i)
 
 	def try_sell(self, i, name, price, stock, unit, inv):
-		inv = self.parse_inv(i)
-		if inv <= 0:
+		if self.ledger.get(i) <= 0:
 			return
-		if inv == 1:
-			inv = "-"
-		else:
-			inv = str(inv - 1) + unit
+		self.ledger.remove(i)
+		_, price, stock, _ = self.elite.trade(i, -1)
 		self.cd.bitcoin += price
-		self.cd.current_market[i][2] = stock + 1
-		self.market[i][2] = stock + 1
-		self.market[i][4] = inv
+		self.market[i][1] = price
+		self.market[i][2] = stock
+		self.market[i][4] = self.ledger.get_text(i)
 
 	def handle(self, inp):
-		self.chooser.handle(-inp.get_pitch())
+		if self.chooser.handle(-inp.get_pitch()):
+			self.set_dirty()
 		nbtn = inp.get_new_buttons()
 		if BaseDev.BTN_FIRE in nbtn:
 			self.try_buy(self.chooser.selected_idx, *self.chooser.selected)
+			self.set_dirty()
 		elif BaseDev.BTN_MISSILE1 in nbtn or BaseDev.BTN_MISSILE2 in nbtn:
 			self.try_sell(self.chooser.selected_idx, *self.chooser.selected)
+			self.set_dirty()
 		nkey, ret = super().handle(inp)
 		return nkey, ret
 
@@ -1120,6 +1292,70 @@ class SystemData(MenuScreen):
 					y += 8
 			y += 8 # Extra line between paragraphs.
 
+class ProfileChooser(MenuScreen):
+	TITLE = "SELECT COMMANDER"
+	MAXNAME = 16
+	ROWS = 16 # Between the heading and the name prompt
+	def __init__(self, elite, cbg, saves):
+		super().__init__(elite, cbg)
+		self.saves = saves
+		self.choice = None
+		self.newname = None
+		lst = []
+		for name, p in saves.get_profiles():
+			s = p["summary"] or {}
+			if s.get("system", None) is not None:
+				where = self.universe.get_system_by_index(s["galaxy"], s["system"]).name
+				credits = "{:.1f}".format(s["bitcoin"])
+			else:
+				where = credits = ""
+			lst.append([name, where, credits])
+		lst.append(["NEW COMMANDER", "", ""])
+		self.profiles = lst
+		self.chooser = Chooser(cbg, self.profiles, 16, 56, "{1:16s} {2:9s} {3:>9s}", self.ROWS)
+		self.setup_screen()
+
+	def handle_keys(self, nkeys):
+		if self.newname is None:
+			if KEY_ENTER in nkeys:
+				self.select()
+			return
+		for k in nkeys:
+			if k in KEY_LETTERS and len(self.newname) < self.MAXNAME:
+				self.newname += KEY_LETTERS[k]
+			elif k == KEY_BACKSPACE:
+				self.newname = self.newname[:-1]
+			elif k == KEY_ENTER:
+				name = self.newname.capitalize()
+				if name and not self.saves.has_profile(name):
+					self.choice = name
+				return
+			elif k == KEY_ESC:
+				self.newname = None
+				return
+
+	def select(self):
+		if self.chooser.selected_idx == len(self.profiles) - 1:
+			self.newname = ""
+		else:
+			self.choice = self.chooser.selected[0]
+
+	def handle(self, inp):
+		if self.newname is None:
+			if self.chooser.handle(-inp.get_pitch()):
+				self.set_dirty()
+			if BaseDev.BTN_FIRE in inp.get_new_buttons():
+				self.select()
+				self.set_dirty()
+		return super().handle(inp)
+
+	def draw(self):
+		c = self.cbg
+		c.drawtext(16, 40, "COMMANDER        PRESENT     CREDITS")
+		self.chooser.draw_list()
+		if self.newname is not None:
+			c.drawtext(16, 200, "NAME: " + self.newname.upper() + "_")
+
 class CommanderData:
 	def __init__(self):
 		self.data_version = 1
@@ -1149,70 +1385,188 @@ class CommanderData:
 		self.docked = True
 		self.current_market = None
 		self.cargo = {}
+		self.gametime = 0.0 # Seconds of game time played
+		self.markets = {}
 
 class Commander:
-	def __init__(self):
+	def __init__(self, saves=None, profile=None, transient=False):
 		self.data = CommanderData()
+		# Without a save store, the single save file in $HOME is used.
+		# A transient commander is never loaded or saved.
+		self.saves = saves
+		self.profile = profile
+		self.transient = transient
+		if profile is not None:
+			self.data.name = profile
 		home = os.environ["HOME"]
-		self.fname = os.path.join(home, ".cbgeliterc")
+		self.fname = os.path.join(home, ".cbgelite.sav")
+		self.legacy_fname = os.path.join(home, ".cbgeliterc")
+		self.set_cargo()
+
+	def set_cargo(self):
+		self.cargo = CargoLedger(self.data.cargo, PRICE_TABLE)
 
 	def load_game(self):
-		try:
-			with open(self.fname, "r") as f:
-				txt = f.read()
-		except OSError:
+		if self.transient:
 			return False
+		if self.saves is not None:
+			try:
+				obj = self.saves.load(self.profile)
+			except (OSError, savegame.SaveError) as e:
+				print("Cannot load {}: {}".format(self.profile, e))
+				obj = None
+			return self.set_data(obj)
 		try:
-			obj = json.loads(txt)
-		except json.JSONDecodeError:
+			with open(self.fname, "rb") as f:
+				buf = f.read()
+			obj = savegame.loads(buf)
+			savegame.writer.loaded(self.fname, buf)
+		except FileNotFoundError:
+			obj = self.load_legacy()
+		except (OSError, savegame.SaveError) as e:
+			print("Cannot load {}: {}".format(self.fname, e))
+			obj = self.load_legacy()
+		return self.set_data(obj)
+
+	def set_data(self, obj):
+		if obj is None:
 			return False
 		for item in obj:
 			if hasattr(self.data, item):
 				setattr(self.data, item, obj[item])
+		self.set_cargo()
 		return True
 
-	def save_game(self):
+	def load_legacy(self):
+		# Games saved as JSON by older versions
 		try:
-			with open(self.fname, "w") as f:
-				f.write(json.dumps(self.data.__dict__, indent="\t"))
+			with open(self.legacy_fname, "r") as f:
+				txt = f.read()
 		except OSError:
-			return False
+			return None
+		try:
+			return json.loads(txt)
+		except json.JSONDecodeError:
+			return None
+
+	def save_game(self):
+		# Written in the background, skipped if nothing changed.
+		if self.transient:
+			return
+		if self.saves is not None:
+			self.saves.save(self.profile, self.data.__dict__)
+		else:
+			savegame.writer.save(self.fname, self.data.__dict__)
 
 	def get_free_cargo_space(self):
 		maxcargo = 35 if self.data.cargo_bay else 20
-		for idx in self.data.cargo:
-			_, _, _, unit = self.data.current_market[int(idx)]
-			if unit == "t":
-				amount = self.data.cargo[idx]
-				maxcargo -= amount
-		return maxcargo
+		return maxcargo - self.cargo.tons
 
 class Elite:
-	def __init__(self, loop=None, config=False, showfps=False):
+	GAME_FRAME_TIME = 0.04 # Game time per frame, independent of the pacing
+	HYPERSPACE_TIME = 3600.0 # Game time spent in witch space per jump
+
+	def __init__(self, loop=None, config=False, showfps=False, record=None, replay=None,
+			synthetic=None, headless=False, soak=None, sound=None):
 		self.loop = loop or asyncio.get_event_loop()
-		self.cbg = CBG(showfps=showfps)
+		self.cbg = CBG(showfps=showfps, headless=headless)
+		try:
+			soundfx.set_output(sound or ("null" if headless else "alsa"))
+		except (OSError, ValueError) as e:
+			print("No sound: {}".format(e))
+			soundfx.set_output("null")
+		self.frametime = 0.04
+		self.cockpit = None
+		self.soak = None
+		if soak:
+			self.soak = SoakStats(self.loop, soak)
 		if self.cbg.width < 320 or self.cbg.height < 240:
 			print("Screen is too small.")
 			print("Please resize your terminal to minimal 160x60 characters.")
 			self.cbg.exit(2)
-		ctrl = Control(self.cbg)
-		if config:
-			ctrl.edit_controls()
+		self.record = record
+		self.replaying = bool(replay)
+		# Replays and synthetic runs never touch the saved games.
+		self.transient = bool(replay or synthetic)
+		self.interactive = not self.transient
+		cmdr = None
+		if replay:
+			# Replays run as fast as possible, without any input hardware.
+			self.inputdev = InputReplay(replay, on_end=lambda: self.cbg.exit(0))
+			cmdr = self.inputdev.commander
+			self.frametime = 0.0
+		elif synthetic:
+			self.inputdev = SyntheticDev(self, synthetic, on_end=lambda: self.cbg.exit(0))
+			if self.inputdev.fast:
+				self.frametime = 0.0
 		else:
-			ctrl.load_mapping()
-		self.inputdev = ctrl.get_evdev()
+			ctrl = Control(self.cbg)
+			if config:
+				ctrl.edit_controls()
+			else:
+				ctrl.load_mapping()
+			self.inputdev = ctrl.get_evdev()
+			self.inputdev.attach(self.loop)
+			ctrl.watch_devices(self.loop)
 		self.universe = Universe()
-		self.commander = Commander()
-		self.commander.load_game()
-		self.market = Market()
-		if self.commander.data.current_market is None:
-			self.set_pricelist()
+		self.routes = RoutePlanner(self.universe)
+		self.market = MarketSim()
+		self.trade_analyzer = TradeAnalyzer(self.universe, self.market)
+		if self.transient:
+			# Replays start from the recorded commander, synthetic runs
+			# from a new one.
+			self.saves = None
+			self.set_commander(None, cmdr)
+		else:
+			self.saves = SaveStore(os.path.join(os.environ["HOME"], ".cbgelite"))
+			self.set_commander(self.get_default_profile())
 		self.ships = AllShips("all_ships.ship").ships
 
+	def get_default_profile(self):
+		profiles = self.saves.get_profiles()
+		if profiles:
+			return profiles[0][0]
+		# First start with a save store, take over the old single save.
+		c = Commander()
+		if c.load_game():
+			self.saves.save(c.data.name, c.data.__dict__)
+		return c.data.name
+
+	def set_commander(self, profile, data=None):
+		self.commander = Commander(self.saves, profile, self.transient)
+		if data is not None:
+			self.commander.set_data(data)
+		else:
+			self.commander.load_game()
+		self.set_pricelist()
+
+	async def choose_commander(self):
+		m = ProfileChooser(self, self.cbg, self.saves)
+		inp = self.inputdev
+		ts = self.loop.time()
+		while m.choice is None:
+			inp.handle()
+			m.handle(inp)
+			self.cbg.redraw_screen()
+			if m.is_idle(inp):
+				await inp.wait_input()
+			ts = await self.framesleep(ts)
+		m.exit()
+		if m.choice != self.commander.profile:
+			self.set_commander(m.choice)
+		if not self.saves.has_profile(m.choice):
+			self.commander.save_game()
+
 	def set_pricelist(self):
 		cd = self.commander.data
 		s = self.universe.get_system_by_index(cd.galaxy, cd.system)
-		self.commander.data.current_market = self.market.get_pricelist(s.economy)
+		self.market.update(cd, s.economy)
+
+	def trade(self, i, amount):
+		return self.market.trade(self.commander.data, i, amount)
+
+	def quote(self, i, amount):
+		return self.market.quote(self.commander.data, i, amount)
 
 	def draw_title(self):
 		sw = 320
@@ -1227,6 +1581,10 @@ class Elite:
 		tm = Microverse(self.cbg, cockpit.g3d, None, self.ships, self.commander, self.universe, particles=0)
 		tm.stop() # Avoid running tactic task
 		cobra = tm.spawn("cobra_mkiii", (0, 0, dz), 0.0, 0.0)
+		self.cbg.clearmap()
+		cockpit.draw_static()
+		self.draw_title()
+		self.cbg.store_static()
 		ts = monotonic()
 		i = 131
 		while True:
@@ -1237,9 +1595,8 @@ class Elite:
 			if dz > 550:
 				dz -= 150
 				cobra.pos = (0.0, 0.0, dz)
-			self.cbg.clearmap()
-			cockpit.draw_background()
-			self.draw_title()
+			self.cbg.restore_static()
+			cockpit.draw_dynamic()
 			self.cbg.setclip(cockpit.spaceclip)
 			cobra.local_roll_pitch(roll, -0.0513)
 			tm.draw()
@@ -1252,12 +1609,26 @@ class Elite:
 
 	async def framesleep(self, ts):
 		now = self.loop.time()
-		dt = max(0.0, ts + 0.04 - now)
+		if self.soak:
+			self.soak.frame_done(now)
+		dt = max(0.0, ts + self.frametime - now)
 		await asyncio.sleep(dt)
+		if self.soak:
+			self.soak.frame_start(self.loop.time())
 		return now
 
+	async def idle(self, aw):
+		# Wait for something outside of the current frame, so the soak
+		# statistics don't count deliberate pauses as frame time.
+		if self.soak:
+			self.soak.frame_done(self.loop.time())
+		ret = await aw
+		if self.soak:
+			self.soak.frame_start(self.loop.time())
+		return ret
+
 	async def microtest(self):
-		cockpit = Cockpit(self, self.cbg, self.commander.data)
+		cockpit = self.cockpit = Cockpit(self, self.cbg, self.commander.data)
 		m = cockpit.m
 		cobra = m.spawn("cobra_mkiii", (-500, 0, 10000), 0.0, 0.0)
 		cobra.add_ai(BaseAi)
@@ -1297,10 +1668,13 @@ class Elite:
 		cd.docked = True
 		cockpit = None
 		while True:
+			self.cockpit = cockpit
+			cd.gametime += self.GAME_FRAME_TIME
 			inp.handle()
 			nkey, ret = m.handle(inp)
 			if cockpit and m is not cockpit:
 				cockpit.handle_hidden()
+				m.refresh_after(self.loop.time(), 0.5)
 			if not ret:
 				if cd.docked: # Docking
 					await m.launch_animation()
@@ -1316,16 +1690,18 @@ class Elite:
 						cockpit.game_over_iteration()
 						self.cbg.redraw_screen()
 						ts = await self.framesleep(ts)
-					self.commander = Commander()
+					self.commander = Commander(self.saves, self.commander.profile, self.transient)
 					cd = self.commander.data
+					self.set_pricelist()
 					m.exit()
 					m = StatusScreen(self, self.cbg, cd)
 					cockpit = None
 				elif m.m.hyperspacing:
 					await m.hyperspace_animation_start()
-					await asyncio.sleep(1)
+					await self.idle(asyncio.sleep(1))
 					await m.hyperspace_animation_end()
 					m.hyperspace()
+					cd.gametime += self.HYPERSPACE_TIME
 					self.set_pricelist()
 			self.cbg.redraw_screen()
 			if 5 in nkey and cd.docked:
@@ -1342,10 +1718,14 @@ class Elite:
 				m = SystemData(self, self.cbg, cd)
 			elif 9 in nkey:
 				m.exit()
+				self.set_pricelist()
 				m = MarketPrices(self, self.cbg, cd)
 			elif 10 in nkey:
 				m.exit()
 				m = StatusScreen(self, self.cbg, cd)
+			elif 11 in nkey:
+				m.exit()
+				m = TradeRoutes(self, self.cbg, cd)
 			elif 2 in nkey: # FIXME: launch
 				if m is not cockpit:
 					m.exit()
@@ -1357,7 +1737,11 @@ class Elite:
 					m.setup_screen()
 			elif 3 in nkey and cd.docked:
 				m.exit()
+				self.set_pricelist()
 				m = MarketBuy(self, self.cbg, cd)
+			if cockpit is None and m.is_idle(inp):
+				# Nothing moves while docked, so just wait for input.
+				await self.idle(inp.wait_input())
 			ts = await self.framesleep(ts)
 
 	async def startup(self):
@@ -1365,7 +1749,13 @@ class Elite:
 		mt.add_done_callback(lambda fut: self.cbg.exit(fut.result()))
 
 	async def run(self):
-		await self.title_screen()
+		if not self.replaying:
+			await self.title_screen()
+		if self.interactive:
+			await self.choose_commander()
+		if self.record:
+			# Recordings start in the menu, with the chosen commander.
+			self.inputdev = InputRecorder(self.inputdev, self.record, self.commander.data.__dict__)
 		await self.menu()
 		#await self.cockpit.launch_animation()
 		#await self.cockpit.hyperspace_animation_start()
@@ -1374,10 +1764,24 @@ class Elite:
 		await self.microtest()
 		return 0
 
+def get_arg(name):
+	if name in sys.argv:
+		i = sys.argv.index(name) + 1
+		if i < len(sys.argv):
+			return sys.argv[i]
+	return None
+
 if __name__ == "__main__":
 	loop = asyncio.get_event_loop()
 	showfps = ("-fps" in sys.argv)
 	config = ("-config" in sys.argv)
-	e = Elite(config=config, showfps=showfps)
+	record = get_arg("-record")
+	replay = get_arg("-replay")
+	synthetic = get_arg("-synthetic")
+	soak = get_arg("-soak")
+	headless = ("-headless" in sys.argv)
+	sound = get_arg("-sound")
+	e = Elite(config=config, showfps=showfps, record=record, replay=replay,
+			synthetic=synthetic, headless=headless, soak=soak, sound=sound)
 	loop.run_until_complete(e.startup())
 	loop.run_forever()
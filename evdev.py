@@ -17,42 +17,103 @@
 
 import struct
 import os
+import errno
 import fcntl
+import ctypes
 import platform
 from time import sleep
 
+# Key codes, for text entry
+KEY_ESC = 1
+KEY_BACKSPACE = 14
+KEY_ENTER = 28
+KEY_LETTERS = dict(zip(
+		list(range(16, 26)) + list(range(30, 39)) + list(range(44, 51)),
+		"qwertyuiopasdfghjklzxcvbnm"))
+
 class Input:
+	NEVENTS = 64 # Max. events read at once
 	def __init__(self, fname):
 		s = struct.Struct("@LLHHi")
 		self.rlen = s.size
-		self.event_parser = s.unpack
-		self.fd = open(fname, "rb")
+		self.event_parser = s.iter_unpack
+		self.evbuf = bytearray(self.rlen * self.NEVENTS)
+		self.evview = memoryview(self.evbuf)
+		self.fd = open(fname, "rb", buffering=0)
 		flags = fcntl.fcntl(self.fd.fileno(), fcntl.F_GETFL)
 		fcntl.fcntl(self.fd.fileno(), fcntl.F_SETFL, flags | os.O_NONBLOCK)
 		self.pressed = set()
+		self.latched = set()
 		self.axis = {}
+		self.axis_changed = set()
+		self.loop = None
+		self.callback = None
+		self.alive = True
+
+	def attach(self, loop, callback=None):
+		# Let the event loop read events as soon as they arrive, instead
+		# of reading them when polled.
+		self.loop = loop
+		self.callback = callback
+		loop.add_reader(self.fd.fileno(), self.read_events)
+
+	def detach(self):
+		if self.loop is not None:
+			self.loop.remove_reader(self.fd.fileno())
+		self.loop = None
+		self.callback = None
 
-	def read_event(self):
-		evb = self.fd.read(self.rlen)
-		if not evb:
-			return None
-		if len(evb) == self.rlen:
-			tsec, tusec, typ, code, value = self.event_parser(evb)
-			return tsec + (tusec / 1000000), typ, code, value
-		else:
-			return None
-
-	def read_key(self):
+	def close(self):
+		self.detach()
+		self.alive = False
+		self.pressed.clear()
+		self.latched.clear()
+		self.fd.close()
+
+	def read_events(self):
+		# Drain all pending events, NEVENTS at a time, into a buffer that
+		# is allocated only once.
+		maxlen = len(self.evbuf)
 		while True:
-			ev = self.read_event()
-			if ev is None:
-				return None
-			ts, typ, code, value = ev
-			if typ == 1: #EV_KEY
+			try:
+				n = self.fd.readinto(self.evbuf)
+			except BlockingIOError:
 				break
-			if typ == 3: #EV_ABS
-				self.axis[code] = value
-		return code, value
+			except OSError as e:
+				if e.errno != errno.ENODEV:
+					raise
+				# Device was unplugged
+				self.close()
+				break
+			if not n:
+				break
+			self.process_events(self.evview[:n - n % self.rlen])
+			if n < maxlen:
+				break
+		if self.callback is not None:
+			self.callback()
+
+	def process_events(self, evb):
+		axis = {}
+		for tsec, tusec, typ, code, value in self.event_parser(evb):
+			if typ == 1: #EV_KEY
+				if value == 0:
+					self.pressed.discard(code)
+				else:
+					self.pressed.add(code)
+					# Remember short key presses until they are seen.
+					self.latched.add(code)
+			elif typ == 3: #EV_ABS
+				axis[code] = value # Only the last value of a burst counts
+		if axis:
+			self.axis.update(axis)
+			self.axis_changed.update(axis)
+
+	def changed_axes(self):
+		# Returns the axes that changed since the last call.
+		ret = self.axis_changed
+		self.axis_changed = set()
+		return ret
 
 	def test(self):
 		a = repr(self.axis)
@@ -67,21 +128,144 @@ class Input:
 			sleep(0.05)
 
 	def keys_pressed(self):
-		ev = self.read_key()
-		if ev is not None:
-			code, value = ev
-			if value == 0:
-				self.pressed.discard(code)
-			else:
-				self.pressed.add(code)
-		return self.pressed
+		if self.loop is None:
+			self.read_events()
+		ret = self.pressed | self.latched
+		self.latched.clear()
+		return ret
 
-def find_devices(joystick=False):
+# Behaves like a single Input, merging the events of devices that come
+# and go at runtime.
+class InputGroup:
+	def __init__(self):
+		self.devices = {}
+		self.loop = None
+		self.callback = None
+
+	def __bool__(self):
+		return bool(self.devices)
+
+	def add(self, fname, dev):
+		self.devices[fname] = dev
+		if self.loop is not None:
+			dev.attach(self.loop, self.callback)
+
+	def remove(self, fname):
+		dev = self.devices.pop(fname)
+		if dev.alive:
+			dev.close()
+
+	def attach(self, loop, callback=None):
+		self.loop = loop
+		self.callback = callback
+		for dev in self.devices.values():
+			dev.attach(loop, callback)
+
+	def detach(self):
+		for dev in self.devices.values():
+			dev.detach()
+		self.loop = None
+		self.callback = None
+
+	@property
+	def axis(self):
+		ret = {}
+		for dev in self.devices.values():
+			if dev.alive:
+				ret.update(dev.axis)
+		return ret
+
+	def changed_axes(self):
+		ret = set()
+		for dev in self.devices.values():
+			ret |= dev.changed_axes()
+		return ret
+
+	def keys_pressed(self):
+		ret = set()
+		for dev in list(self.devices.values()):
+			if dev.alive:
+				ret |= dev.keys_pressed()
+		return ret
+
+class Inotify:
+	IN_ATTRIB = 0x00000004
+	IN_CREATE = 0x00000100
+	IN_DELETE = 0x00000200
+	def __init__(self, path, mask):
+		libc = ctypes.CDLL(None, use_errno=True)
+		self.fd = libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+		if self.fd < 0:
+			e = ctypes.get_errno()
+			raise OSError(e, os.strerror(e))
+		if libc.inotify_add_watch(self.fd, path.encode(), mask) < 0:
+			e = ctypes.get_errno()
+			os.close(self.fd)
+			raise OSError(e, os.strerror(e), path)
+
+	def drain(self):
+		# We only need to know that something changed, not what.
+		while True:
+			try:
+				if not os.read(self.fd, 4096):
+					break
+			except BlockingIOError:
+				break
+
+# Keeps the keyboards and joysticks groups up to date while devices are
+# plugged in or removed.
+class InputManager:
+	def __init__(self):
+		self.keyboards = InputGroup()
+		self.joysticks = InputGroup()
+		self.inotify = None
+		self.loop = None
+		self.log = print
+		self.scan_handle = None
+		self.scan(ignore_errors=False)
+
+	def scan(self, ignore_errors=True):
+		self.scan_handle = None
+		for group, joystick in ((self.keyboards, False), (self.joysticks, True)):
+			found = dict(find_all_devices(joystick))
+			for fname in list(group.devices):
+				if fname not in found or not group.devices[fname].alive:
+					group.remove(fname)
+					if self.log:
+						self.log("Input device removed:", fname)
+			for fname, name in found.items():
+				if fname in group.devices:
+					continue
+				try:
+					group.add(fname, Input(fname))
+				except OSError:
+					# udev might not have fixed the permissions yet. We
+					# will get another notification when it does.
+					if not ignore_errors:
+						raise
+					continue
+				if self.log:
+					self.log("Input device added:", name)
+
+	def watch(self, loop, log=None):
+		self.loop = loop
+		self.log = log
+		self.inotify = Inotify("/dev/input", Inotify.IN_CREATE | Inotify.IN_DELETE | Inotify.IN_ATTRIB)
+		loop.add_reader(self.inotify.fd, self.handle_inotify)
+
+	def handle_inotify(self):
+		self.inotify.drain()
+		# Wait a little for the device to settle before looking at it.
+		if self.scan_handle is None:
+			self.scan_handle = self.loop.call_later(0.5, self.scan)
+
+def find_all_devices(joystick=False):
 	with open("/proc/bus/input/devices", "r") as f:
 		lines = f.readlines()
 	name = None
 	handlers = None
 	ev = None
+	ret = []
 	for l in lines:
 		l = l.strip(" \r\n")
 		if l.startswith("N: Name="):
@@ -91,14 +275,20 @@ def find_devices(joystick=False):
 		elif l.startswith("B: EV="):
 			ev = l.split("=",1)[-1]
 			if ((int(ev, 16) & 0x120003) == 0x120003 and not joystick) or (ev.endswith("1b") and joystick):
-				if joystick and not "js0" in handlers:
+				if joystick and not any(h.startswith("js") for h in handlers):
 					continue
-				print("Found device: {}".format(name))
-				print("Handlers: {}".format(repr(handlers)))
 				for h in handlers:
 					if h.startswith("event"):
-						return "/dev/input/"+h, name
-	return None, None
+						ret.append(("/dev/input/"+h, name))
+	return ret
+
+def find_devices(joystick=False):
+	devs = find_all_devices(joystick)
+	if not devs:
+		return None, None
+	fname, name = devs[0]
+	print("Found device: {}".format(name))
+	return fname, name
 
 if __name__ == "__main__":
 	fname, dname = find_devices(joystick=True)
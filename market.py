@@ -16,28 +16,32 @@
 # along with CBGElite.  If not, see <http://www.gnu.org/licenses/>.
 
 import random
+from math import exp, sqrt
+
+# Name, base price, economy factor, unit, base quantity, mask
+PRICE_TABLE = [
+		("Food",         19,  -2, "t", 6,   0x01), # 0
+		("Textiles",     20,  -1, "t", 10,  0x03), # 1
+		("Radioactives", 65,  -3, "t", 2,   0x07), # 2
+		("Slaves",       40,  -5, "t", 226, 0x1f), # 3
+		("Liquor/Wines", 83,  -5, "t", 251, 0x0f), # 4
+		("Luxuries",     196,  8, "t", 54,  0x03), # 5
+		("Narcotics",    235, 29, "t", 8,   0x78), # 6
+		("Computers",    154, 14, "t", 56,  0x03), # 7
+		("Machinery",    117, 6,  "t", 40,  0x07), # 8
+		("Alloys",       78,  1,  "t", 17,  0x1f), # 9
+		("Firearms",     124, 14, "t", 29,  0x07), # 10
+		("Furs",         176, -9, "t", 220, 0x3f), # 11
+		("Minerals",     32,  -1, "t", 53,  0x03), # 12
+		("Gold",         97,  -1, "kg", 66, 0x07), # 13
+		("Platinum",     171, -2, "kg", 55, 0x1f), # 14
+		("Gem-stones",   45,  -1, "g", 250, 0x0f), # 15
+		("Alien Items",  53,  15, "t", 192, 0x03)  # 16
+	]
 
 class Market:
 	def __init__(self):
-		self.price_table = [
-				("Food",         19,  -2, "t", 6,   0x01), # 0
-				("Textiles",     20,  -1, "t", 10,  0x03), # 1
-				("Radioactives", 65,  -3, "t", 2,   0x07), # 2
-				("Slaves",       40,  -5, "t", 226, 0x1f), # 3
-				("Liquor/Wines", 83,  -5, "t", 251, 0x0f), # 4
-				("Luxuries",     196,  8, "t", 54,  0x03), # 5
-				("Narcotics",    235, 29, "t", 8,   0x78), # 6
-				("Computers",    154, 14, "t", 56,  0x03), # 7
-				("Machinery",    117, 6,  "t", 40,  0x07), # 8
-				("Alloys",       78,  1,  "t", 17,  0x1f), # 9
-				("Firearms",     124, 14, "t", 29,  0x07), # 10
-				("Furs",         176, -9, "t", 220, 0x3f), # 11
-				("Minerals",     32,  -1, "t", 53,  0x03), # 12
-				("Gold",         97,  -1, "kg", 66, 0x07), # 13
-				("Platinum",     171, -2, "kg", 55, 0x1f), # 14
-				("Gem-stones",   45,  -1, "g", 250, 0x0f), # 15
-				("Alien Items",  53,  15, "t", 192, 0x03)  # 16
-			]
+		self.price_table = PRICE_TABLE
 
 	def calc_price(self, bp, mask, econ, ef):
 		randb = random.randrange(255)
@@ -58,6 +62,178 @@ class Market:
 			mkt.append([name, price, stock, unit])
 		return mkt
 
+# Markets that evolve over game time. Each visited system keeps [time,
+# prices, stocks] in cd.markets. When it is looked at again, the elapsed time
+# is applied in one step: prices follow an Ornstein-Uhlenbeck process around
+# the typical price, stock is restocked towards its typical level.
+class MarketSim(Market):
+	PRICE_TAU = 1800.0 # Seconds for price deviations to decay by 1/e
+	PRICE_SPREAD = 0.06 # Long run price spread relative to typical price
+	STOCK_TAU = 900.0 # Seconds for stock to recover by 1-1/e
+	TRADE_IMPACT = 0.01 # Relative price change per unit traded
+
+	def typical(self, econ):
+		# Prices and stock with the random part at its midpoint
+		ret = []
+		for name, bp, ef, unit, bq, mask in self.price_table:
+			price = ((bp + (mask >> 1) + econ * ef) & 255) * 0.04
+			stock = max(0, bq + (mask >> 1) - econ * ef) % 64
+			ret.append((price, stock))
+		return ret
+
+	def _key(self, galaxy, system):
+		return "{}:{}".format(galaxy, system)
+
+	def get_state(self, cd, econ):
+		key = self._key(cd.galaxy, cd.system)
+		st = cd.markets.get(key, None)
+		if st is None:
+			if cd.current_market is not None and not cd.markets:
+				# Carry over the market of a save from before the simulation
+				pt = cd.current_market
+			else:
+				pt = self.get_pricelist(econ)
+			st = [cd.gametime, [i[1] for i in pt], [float(i[2]) for i in pt]]
+			cd.markets[key] = st
+		return st
+
+	def advance(self, st, econ, now):
+		dt = now - st[0]
+		if dt <= 0:
+			return
+		a = exp(-dt / self.PRICE_TAU)
+		b = exp(-dt / self.STOCK_TAU)
+		noise = sqrt(1.0 - a * a) * self.PRICE_SPREAD
+		prices = st[1]
+		stocks = st[2]
+		for i, (mp, ms) in enumerate(self.typical(econ)):
+			p = mp + (prices[i] - mp) * a + mp * noise * random.gauss(0.0, 1.0)
+			prices[i] = max(0.04, p)
+			stocks[i] = ms + (stocks[i] - ms) * b
+		st[0] = now
+
+	def update(self, cd, econ):
+		# Bring the market of the current system up to date
+		st = self.get_state(cd, econ)
+		self.advance(st, econ, cd.gametime)
+		cd.current_market = self.get_snapshot(st)
+		return cd.current_market
+
+	def get_snapshot(self, st):
+		mkt = []
+		for i, (name, bp, ef, unit, bq, mask) in enumerate(self.price_table):
+			mkt.append([name, round(st[1][i], 2), int(round(st[2][i])), unit])
+		return mkt
+
+	def _impact(self, price, amount):
+		return max(0.04, price * (1.0 + self.TRADE_IMPACT * amount))
+
+	def quote(self, cd, i, amount):
+		# Trades are settled at the price after their own impact, so that
+		# buying and selling back always loses a little.
+		st = cd.markets[self._key(cd.galaxy, cd.system)]
+		return round(self._impact(st[1][i], amount), 2)
+
+	def trade(self, cd, i, amount):
+		# Buy (amount > 0) or sell (amount < 0) in the current market.
+		# Returns the market item, with the price to settle the trade at.
+		st = cd.markets[self._key(cd.galaxy, cd.system)]
+		st[1][i] = self._impact(st[1][i], amount)
+		st[2][i] = max(0.0, st[2][i] - amount)
+		item = cd.current_market[i]
+		item[1] = round(st[1][i], 2)
+		item[2] = int(round(st[2][i]))
+		return item
+
+# Cargo counts and the tonnage they take up, written through to the cargo
+# dict of the commander data.
+class CargoLedger:
+	def __init__(self, cargo, price_table):
+		self.cargo = cargo
+		self.units = [item[3] for item in price_table]
+		self.counts = [0] * len(self.units)
+		self.tons = 0
+		for key, amount in cargo.items():
+			i = int(key)
+			self.counts[i] = amount
+			if self.units[i] == "t":
+				self.tons += amount
+
+	def get(self, i):
+		return self.counts[i]
+
+	def add(self, i, amount=1):
+		count = self.counts[i] + amount
+		if count < 0:
+			raise ValueError("Not enough cargo")
+		self.counts[i] = count
+		if self.units[i] == "t":
+			self.tons += amount
+		key = str(i) # JSon object keys must be strings
+		if count:
+			self.cargo[key] = count
+		elif key in self.cargo:
+			del self.cargo[key]
+
+	def remove(self, i, amount=1):
+		self.add(i, -amount)
+
+	def get_text(self, i):
+		# Inventory as shown on the market screen, like "12t"
+		count = self.counts[i]
+		if not count:
+			return "-"
+		return str(count) + self.units[i]
+
+# Most profitable commodities to carry to systems a few jumps away, judged
+# by the typical prices of each economy.
+class TradeAnalyzer:
+	MAXJUMPS = 3
+
+	def __init__(self, universe, market, maxjumps=MAXJUMPS, maxjump=7.0):
+		self.universe = universe
+		self.market = market
+		self.maxjumps = maxjumps
+		self.maxjump = maxjump
+		# Typical prices only depend on the economy, of which there are 8.
+		self.prices = [[p for p, s in market.typical(econ)] for econ in range(8)]
+		self.key = None
+		self.result = None
+
+	def analyze(self, galaxy, system):
+		# List of (profit, item, dst, jumps) for every commodity and every
+		# reachable system, most profitable first.
+		key = (galaxy, system)
+		if key == self.key:
+			return self.result
+		u = self.universe
+		here = self.prices[u.get_system_by_index(galaxy, system).economy]
+		ret = []
+		for dst, jumps in u.get_within_jumps(galaxy, system, self.maxjumps, self.maxjump).items():
+			if not jumps:
+				continue
+			there = self.prices[u.get_system_by_index(galaxy, dst).economy]
+			for i, (buy, sell) in enumerate(zip(here, there)):
+				if sell > buy:
+					ret.append((sell - buy, i, dst, jumps))
+		ret.sort(key=lambda r: (-r[0], r[3], r[2], r[1]))
+		self.key = key
+		self.result = ret
+		return ret
+
+	def get_best(self, galaxy, system, n=10):
+		# The best commodity for each destination, n destinations at most.
+		ret = []
+		seen = set()
+		for r in self.analyze(galaxy, system):
+			if r[2] in seen:
+				continue
+			seen.add(r[2])
+			ret.append(r)
+			if len(ret) >= n:
+				break
+		return ret
+
 def contraband_score(cargo):
 	return cargo.get("3", 0) + 2 * cargo.get("6", 0) + cargo.get("10", 0)
 
@@ -25,10 +25,9 @@ from time import sleep
 from collections import deque
 import functools
 from sounds import SoundFX
-from ai import CanisterAi, BaseAi, MissileAi, EnemyMissileAi
+from ai import AiScheduler, CanisterAi, BaseAi, MissileAi, EnemyMissileAi
 from market import contraband_score
 
-import asyncio
 from enum import Enum
 
 random.seed(monotonic())
@@ -379,7 +378,7 @@ class Microverse:
 	VIEW_LEFT = "nx"
 	def __init__(self, cbg, g3d, lasers, ships, commander, universe, particles=400, hyperspace=False):
 		self.sfx = soundfx
-		self.loop = asyncio.get_event_loop()
+		self.ai_scheduler = AiScheduler()
 		self.g3d = g3d
 		self.cbg = cbg
 		self.ships = ships
@@ -452,7 +451,7 @@ class Microverse:
 				self.VIEW_LEFT: "Left View"
 			}
 		self.set_view(self.VIEW_FRONT)
-		self.tactic_task = self.loop.create_task(self.coro_tactic())
+		self.ai_scheduler.run(self.run_tactic())
 		self.missile_state = MissileState.UNARMED
 		self.missile_target = None
 		self.in_combat = False
@@ -489,7 +488,7 @@ class Microverse:
 			s.angry = angry
 			s.ecm = ecm[i]
 
-	async def coro_tactic(self):
+	def run_tactic(self):
 		cd = self.cd
 		rocks = ("asteroid", "rock", "boulder")
 		lone_wolves = ("cobra_mkiii", "asp_mkii", "python", "fer-de-lance", "moray_star_boat")
@@ -535,7 +534,7 @@ class Microverse:
 								n.append(random.choice(wolf_pack))
 								ecm.append(rndr(256) < 10)
 							self._spawn_ships(n, ecm=ecm, bold=True, angry=True)
-			await asyncio.sleep(2.0)
+			yield 2.0
 			if self.energy < 0.1:
 				self.sfx.play_beep()
 				self.set_subtext("ENERGY LOW!")
@@ -560,15 +559,14 @@ class Microverse:
 			self.set_subtext("Not enough fuel!")
 			return
 		st = self.universe.get_system_by_index(self.cd.galaxy, self.cd.target)
-		hct = self.loop.create_task(self.hyperspace_countdown(st, d))
-		hct.add_done_callback(lambda fut: fut.result())
+		self.ai_scheduler.run(self.hyperspace_countdown(st, d))
 		self.countdown = True
 
-	async def hyperspace_countdown(self, st, d):
+	def hyperspace_countdown(self, st, d):
 		t = 9
 		while not self.dead and t > 0:
 			self.set_subtext("Hyperspace to {} {}".format(st.name, t))
-			await asyncio.sleep(1)
+			yield 1.0
 			t -= 1
 		self.countdown = False
 		if t == 0:
@@ -666,8 +664,7 @@ class Microverse:
 			name, _, _, unit = self.cd.current_market[idx]
 			if unit == "t" and self.commander.get_free_cargo_space() < 1:
 				return False
-			idx = str(idx)
-			self.cd.cargo[idx] = self.cd.cargo.get(idx, 0) + 1
+			self.commander.cargo.add(idx)
 			self.set_subtext("Cargo acquired: {}".format(name))
 			obj.vanish()
 			return True
@@ -685,15 +682,14 @@ class Microverse:
 			if idx == 12 and self.commander.get_free_cargo_space() < qty:
 				return False
 			name = self.cd.current_market[idx][0]
-			idx = str(idx)
-			self.cd.cargo[idx] = self.cd.cargo.get(idx, 0) + qty
+			self.commander.cargo.add(idx, qty)
 			self.set_subtext("Cargo acquired: {}".format(name))
 			obj.vanish()
 			return True
 		elif obj.type == "thargon":
 			if self.commander.get_free_cargo_space() < 1:
 				return False
-			self.cd.cargo["16"] = self.cd.cargo.get("16", 0) + 1
+			self.commander.cargo.add(16)
 			self.set_subtext("Cargo acquired: Alien Items")
 			obj.vanish()
 			return True
@@ -713,6 +709,7 @@ class Microverse:
 
 	def handle(self):
 		self.move(self.speed + self.jumpspeed)
+		self.ai_scheduler.tick()
 		angry = False
 		for o in self.objects:
 			o.handle()
@@ -772,6 +769,7 @@ class Microverse:
 		return obj
 
 	def _remove_particles(self, particles):
+		yield 10.0
 		for p in particles:
 			self.particles.discard(p)
 
@@ -790,7 +788,7 @@ class Microverse:
 			p.set_dir(vx, vy, vz)
 			particles.append(p)
 			self.particles.add(p)
-		self.loop.call_later(10, self._remove_particles, particles)
+		self.ai_scheduler.run(self._remove_particles(particles))
 
 	def remove_object(self, obj):
 		if self.missile_target == obj and self.missile_state == MissileState.TARGET:
@@ -871,11 +869,10 @@ class Microverse:
 			if o.distance < 20000 and not o.type in self.non_ml_objects:
 				self.set_subtext("Mass Locked!")
 				return
-		j = self.loop.create_task(self.coro_jump())
-		j.add_done_callback(lambda f: f.result())
+		self.ai_scheduler.run(self.run_jump())
 		self.jumping = True
 
-	async def _check_jump_dist(self, ramp=0.0):
+	def _check_jump_dist(self, ramp=0.0):
 		self.set_subtext("JUMP")
 		for t in range(20):
 			if self.get_planet_dist() < 60000 or self.dead:
@@ -888,24 +885,24 @@ class Microverse:
 					self.jumpspeed = 0.0
 					return False
 			self.jumpspeed += ramp
-			await asyncio.sleep(0.1)
+			yield 0.1
 		return True
 
-	async def coro_jump(self):
+	def run_jump(self):
 		splayer = self.sfx.play_jump()
-		if not await self._check_jump_dist(15.0):
+		if not (yield from self._check_jump_dist(15.0)):
 			if splayer is not None:
 				splayer.stop_play()
 			self.sfx.play_jumpabort()
 			return
 		self.jumpspeed = 300.0
 		for i in range(2):
-			if not await self._check_jump_dist(0.0):
+			if not (yield from self._check_jump_dist(0.0)):
 				if splayer is not None:
 					splayer.stop_play()
 				self.sfx.play_jumpabort()
 				return
-		if not await self._check_jump_dist(-15.0):
+		if not (yield from self._check_jump_dist(-15.0)):
 			if splayer is not None:
 				splayer.stop_play()
 			self.sfx.play_jumpabort()
@@ -0,0 +1,117 @@
+#
+# Copyright (c) 2021 David Jander <djander@gmail.com>
+#
+# This file is part of CBGElite.
+#
+# CBGElite is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, version 2 of the License.
+#
+# CBGElite is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with CBGElite.  If not, see <http://www.gnu.org/licenses/>.
+
+import os
+import atexit
+import random
+import struct
+from control import BaseDev
+import savegame
+
+# File format: A header followed by the commander data at the start of
+# the recording (in the saved game format, see savegame.py), and one
+# record per input tick. Each tick record holds the random seed for that
+# tick, the analog controls, a bitmask of the buttons and the list of
+# pressed key codes.
+MAGIC = b"CBGR"
+VERSION = 3
+header = struct.Struct("<4sHQI")
+tick = struct.Struct("<IfffHB")
+keycode = struct.Struct("<H")
+
+# Records dev on every handle(). random is reseeded every tick, so a replay
+# gets the same random numbers.
+class InputRecorder(BaseDev):
+	def __init__(self, dev, fname, commander, seed=None):
+		super().__init__()
+		self.dev = dev
+		if seed is None:
+			seed = int.from_bytes(os.urandom(8), "little")
+		self.seeds = random.Random(seed)
+		cmdr = savegame.dumps(commander)
+		self.f = open(fname, "wb")
+		self.f.write(header.pack(MAGIC, VERSION, seed, len(cmdr)))
+		self.f.write(cmdr)
+		atexit.register(self.close)
+
+	def close(self):
+		if not self.f.closed:
+			self.f.close()
+
+	def attach(self, loop):
+		self.dev.attach(loop)
+
+	async def wait_input(self, timeout=None):
+		await self.dev.wait_input(timeout)
+
+	def handle(self):
+		d = self.dev
+		d.handle()
+		self.roll = d.roll
+		self.pitch = d.pitch
+		self.throttle = d.throttle
+		self.btns = set(d.btns)
+		self.keys = set(d.keys)
+		seed = self.seeds.getrandbits(32)
+		random.seed(seed)
+		bmask = 0
+		for b in self.btns:
+			bmask |= (1 << b)
+		keys = [k for k in self.keys if k < 0x10000][:255]
+		self.f.write(tick.pack(seed, self.roll, self.pitch, self.throttle, bmask, len(keys)))
+		for k in keys:
+			self.f.write(keycode.pack(k))
+
+# Plays a recording back, one tick per handle(). on_end is called when it
+# is over, the recorded commander data is in self.commander.
+class InputReplay(BaseDev):
+	def __init__(self, fname, on_end=None):
+		super().__init__()
+		with open(fname, "rb") as f:
+			self.data = f.read()
+		try:
+			magic, version, self.seed, ncmdr = header.unpack_from(self.data, 0)
+		except struct.error:
+			magic = version = None
+		if magic != MAGIC or version != VERSION:
+			raise ValueError("{} is not an input recording".format(fname))
+		self.pos = header.size + ncmdr
+		try:
+			self.commander = savegame.loads(self.data[header.size:self.pos])
+		except savegame.SaveError as e:
+			raise ValueError("{}: {}".format(fname, e))
+		self.ticks = 0
+		self.on_end = on_end
+		random.seed(self.seed)
+
+	def handle(self):
+		if self.pos + tick.size > len(self.data):
+			self.btns = set()
+			self.keys = set()
+			if self.on_end is not None:
+				self.on_end()
+			return
+		seed, roll, pitch, throttle, bmask, nkeys = tick.unpack_from(self.data, self.pos)
+		self.pos += tick.size
+		self.roll = roll
+		self.pitch = pitch
+		self.throttle = throttle
+		self.btns = {b for b in range(16) if bmask & (1 << b)}
+		self.keys = {keycode.unpack_from(self.data, self.pos + i * keycode.size)[0] for i in range(nkeys)}
+		self.pos += nkeys * keycode.size
+		self.ticks += 1
+		random.seed(seed)
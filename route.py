@@ -0,0 +1,96 @@
+#
+# Copyright (c) 2021 David Jander <djander@gmail.com>
+#
+# This file is part of CBGElite.
+#
+# CBGElite is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, version 2 of the License.
+#
+# CBGElite is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with CBGElite.  If not, see <http://www.gnu.org/licenses/>.
+
+from heapq import heappush, heappop
+
+# Routes over several jumps, between systems no farther apart than a full
+# tank. Either the shortest in distance, or the one with the fewest jumps.
+class RoutePlanner:
+	MAXJUMP = 7.0
+	MODES = ("distance", "jumps")
+	CACHE_MAX = 4096
+
+	def __init__(self, universe, maxjump=MAXJUMP):
+		self.universe = universe
+		self.maxjump = maxjump
+		self.mode = "distance"
+		self.graphs = {}
+		self.cache = {}
+
+	def toggle_mode(self):
+		self.mode = self.MODES[(self.MODES.index(self.mode) + 1) % len(self.MODES)]
+
+	def get_graph(self, galaxy):
+		# For each system a list of (index, distance) of the systems in reach
+		graph = self.graphs.get(galaxy)
+		if graph is not None:
+			return graph
+		u = self.universe
+		graph = []
+		for i in range(256):
+			# Exact distances as weights, so they agree with the heuristic.
+			graph.append([(j, u.get_distance_by_index(galaxy, i, j))
+					for j in u.get_reachable(galaxy, i, self.maxjump)])
+		self.graphs[galaxy] = graph
+		return graph
+
+	def route(self, galaxy, src, dst, mode=None):
+		# List of system indices from src to dst, or None if dst cannot be
+		# reached.
+		mode = mode or self.mode
+		key = (galaxy, src, dst, mode)
+		if key in self.cache:
+			return self.cache[key]
+		r = self.search(galaxy, src, dst, mode == "jumps")
+		if len(self.cache) >= self.CACHE_MAX:
+			self.cache.clear()
+		self.cache[key] = r
+		return r
+
+	def search(self, galaxy, src, dst, jumps):
+		# A* search. The straight distance to the destination (or the
+		# number of jumps it takes at least) never overestimates the cost.
+		graph = self.get_graph(galaxy)
+		dist = self.universe.get_distance_by_index
+		def h(i):
+			d = dist(galaxy, i, dst)
+			return d / self.maxjump if jumps else d
+		best = {src: 0.0}
+		prev = {}
+		todo = [(h(src), 0.0, src)]
+		while todo:
+			f, g, i = heappop(todo)
+			if i == dst:
+				ret = [i]
+				while i in prev:
+					i = prev[i]
+					ret.append(i)
+				ret.reverse()
+				return ret
+			if g > best[i]:
+				continue
+			for j, d in graph[i]:
+				c = g + (1.0 if jumps else d)
+				if c < best.get(j, c + 1.0):
+					best[j] = c
+					prev[j] = i
+					heappush(todo, (c + h(j), c, j))
+		return None
+
+	def route_distance(self, galaxy, route):
+		dist = self.universe.get_distance_by_index
+		return sum(dist(galaxy, a, b) for a, b in zip(route, route[1:]))
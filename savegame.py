@@ -0,0 +1,388 @@
+#
+# Copyright (c) 2021 David Jander <djander@gmail.com>
+#
+# This file is part of CBGElite.
+#
+# CBGElite is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, version 2 of the License.
+#
+# CBGElite is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with CBGElite.  If not, see <http://www.gnu.org/licenses/>.
+
+import os
+import sys
+import json
+import struct
+import zlib
+import fcntl
+import atexit
+import tempfile
+from time import time
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor
+
+# File format: A header with magic "CBGC" and the format version (u16),
+# one tagged value (normally the map of commander data fields) and a
+# crc32 of everything before it (u32). All numbers are little endian.
+# Values are a tag byte followed by the data:
+#
+#	N: None, T: True, F: False
+#	b, h, i, q: int (i8, i16, i32 or i64, the smallest that fits)
+#	d: float (f64)
+#	s: string (u32 length + utf-8)
+#	l: list (u32 count + values)
+#	m: map (u32 count + string key and value pairs)
+#
+# Files are written to a temporary file first and then renamed over the
+# old one, so a crash never leaves half a save behind.
+MAGIC = b"CBGC"
+VERSION = 1
+header = struct.Struct("<4sH")
+trailer = struct.Struct("<I")
+u32 = struct.Struct("<I")
+ints = [(b"b", struct.Struct("<b")), (b"h", struct.Struct("<h")),
+		(b"i", struct.Struct("<i")), (b"q", struct.Struct("<q"))]
+f64 = struct.Struct("<d")
+int_tags = dict(ints)
+
+class SaveError(Exception):
+	pass
+
+def _encode(obj, out):
+	if obj is None:
+		out.append(b"N")
+	elif obj is True:
+		out.append(b"T")
+	elif obj is False:
+		out.append(b"F")
+	elif isinstance(obj, int):
+		for tag, st in ints:
+			lim = 1 << (st.size * 8 - 1)
+			if -lim <= obj < lim:
+				out.append(tag + st.pack(obj))
+				break
+		else:
+			raise SaveError("Integer too large")
+	elif isinstance(obj, float):
+		out.append(b"d" + f64.pack(obj))
+	elif isinstance(obj, str):
+		b = obj.encode("utf-8")
+		out.append(b"s" + u32.pack(len(b)) + b)
+	elif isinstance(obj, (list, tuple)):
+		out.append(b"l" + u32.pack(len(obj)))
+		for v in obj:
+			_encode(v, out)
+	elif isinstance(obj, dict):
+		out.append(b"m" + u32.pack(len(obj)))
+		for k, v in obj.items():
+			_encode(str(k), out)
+			_encode(v, out)
+	else:
+		raise SaveError("Cannot save {}".format(type(obj).__name__))
+
+def _decode(buf, pos):
+	tag = buf[pos:pos + 1]
+	pos += 1
+	if tag == b"N":
+		return None, pos
+	elif tag == b"T":
+		return True, pos
+	elif tag == b"F":
+		return False, pos
+	elif tag in int_tags:
+		st = int_tags[tag]
+		return st.unpack_from(buf, pos)[0], pos + st.size
+	elif tag == b"d":
+		return f64.unpack_from(buf, pos)[0], pos + f64.size
+	elif tag == b"s":
+		n, = u32.unpack_from(buf, pos)
+		pos += u32.size
+		return buf[pos:pos + n].decode("utf-8"), pos + n
+	elif tag == b"l":
+		n, = u32.unpack_from(buf, pos)
+		pos += u32.size
+		ret = []
+		for i in range(n):
+			v, pos = _decode(buf, pos)
+			ret.append(v)
+		return ret, pos
+	elif tag == b"m":
+		n, = u32.unpack_from(buf, pos)
+		pos += u32.size
+		ret = {}
+		for i in range(n):
+			k, pos = _decode(buf, pos)
+			v, pos = _decode(buf, pos)
+			ret[k] = v
+		return ret, pos
+	raise SaveError("Bad tag {!r} at {}".format(tag, pos - 1))
+
+def dumps(obj):
+	out = [header.pack(MAGIC, VERSION)]
+	_encode(obj, out)
+	buf = b"".join(out)
+	return buf + trailer.pack(zlib.crc32(buf))
+
+def loads(buf):
+	if len(buf) < header.size + trailer.size:
+		raise SaveError("File too short")
+	magic, version = header.unpack_from(buf, 0)
+	if magic != MAGIC:
+		raise SaveError("Not a saved game")
+	if version > VERSION:
+		raise SaveError("Saved by a newer version")
+	end = len(buf) - trailer.size
+	crc, = trailer.unpack_from(buf, end)
+	if zlib.crc32(buf[:end]) != crc:
+		raise SaveError("Checksum error")
+	try:
+		obj, pos = _decode(buf, header.size)
+	except (struct.error, UnicodeDecodeError) as e:
+		raise SaveError(str(e))
+	if pos != end:
+		raise SaveError("Trailing data")
+	return obj
+
+def write_atomic(fname, buf):
+	# A unique temporary file, so that writers never share one.
+	fd, tmp = tempfile.mkstemp(prefix=os.path.basename(fname) + ".",
+			dir=os.path.dirname(os.path.abspath(fname)))
+	try:
+		with os.fdopen(fd, "wb") as f:
+			f.write(buf)
+			f.flush()
+			os.fsync(f.fileno())
+		os.replace(tmp, fname)
+	except BaseException:
+		try:
+			os.unlink(tmp)
+		except OSError:
+			pass
+		raise
+	# Make the rename itself durable too
+	try:
+		fd = os.open(os.path.dirname(os.path.abspath(fname)), os.O_RDONLY)
+	except OSError:
+		return
+	try:
+		os.fsync(fd)
+	except OSError:
+		pass
+	finally:
+		os.close(fd)
+
+def read(fname):
+	with open(fname, "rb") as f:
+		return loads(f.read())
+
+def export_json(obj, fname=None):
+	txt = json.dumps(obj, indent="\t")
+	if fname is None:
+		return txt
+	with open(fname, "w") as f:
+		f.write(txt)
+
+# Writes saved games on one background thread, so the game never waits for
+# the disk. Saves that would not change the file are skipped.
+class SaveWriter:
+	def __init__(self):
+		self.executor = None
+		self.pending = None
+		self.last = {}
+		atexit.register(self.flush)
+
+	def save(self, fname, obj):
+		buf = dumps(obj)
+		if self.last.get(fname, None) == buf:
+			return None
+		self.last[fname] = buf
+		return self.submit(self._write, fname, buf)
+
+	def submit(self, fn, *args):
+		# Run fn on the writer thread, after all earlier writes.
+		if self.executor is None:
+			self.executor = ThreadPoolExecutor(max_workers=1)
+		self.pending = self.executor.submit(fn, *args)
+		return self.pending
+
+	def _write(self, fname, buf):
+		try:
+			write_atomic(fname, buf)
+		except OSError as e:
+			# Try again on the next save
+			self.last.pop(fname, None)
+			print("Saving {} failed: {}".format(fname, e), file=sys.stderr)
+			return False
+		return True
+
+	def loaded(self, fname, buf):
+		# Remember what is on disk, to skip saving it again unchanged
+		self.last[fname] = buf
+
+	def flush(self):
+		# Wait for all pending writes
+		if self.pending is not None:
+			self.pending.result()
+			self.pending = None
+
+writer = SaveWriter()
+
+# A directory with a profile per commander: its latest save, a few rolling
+# autosaves and an index with a summary of each profile.
+class SaveStore:
+	INDEX = "index.sav"
+	LOCK = "index.lock"
+	AUTOSAVES = 3
+
+	def __init__(self, path, writer=writer):
+		self.path = path
+		self.writer = writer
+		self.index = None
+		self.last = {}
+
+	def _fname(self, name):
+		return os.path.join(self.path, name)
+
+	@contextmanager
+	def locked(self):
+		# Other games may share the store. The index is only changed with
+		# this lock held, after reading it again.
+		fd = os.open(self._fname(self.LOCK), os.O_RDWR | os.O_CREAT, 0o644)
+		try:
+			fcntl.flock(fd, fcntl.LOCK_EX)
+			yield
+		finally:
+			os.close(fd)
+
+	def get_index(self, reload=False):
+		if self.index is None or reload:
+			self.index = self.read_index()
+		return self.index
+
+	def read_index(self):
+		try:
+			return read(self._fname(self.INDEX))
+		except FileNotFoundError:
+			# New store, or the index got lost
+			return self.rebuild_index()
+		except (OSError, SaveError) as e:
+			print("Rebuilding save index: {}".format(e), file=sys.stderr)
+			return self.rebuild_index()
+
+	def rebuild_index(self):
+		# Only needed if the index is lost, reads all saved games.
+		idx = {"next_id": 0, "profiles": {}}
+		try:
+			files = sorted(os.listdir(self.path))
+		except OSError:
+			return idx
+		for f in files:
+			if not f.startswith("cmdr-") or "-auto" in f or not f.endswith(".sav"):
+				continue
+			try:
+				pid = int(f[5:-4])
+				obj = read(self._fname(f))
+				saved = os.path.getmtime(self._fname(f))
+			except (ValueError, OSError, SaveError):
+				continue
+			prefix = "cmdr-{}-auto".format(pid)
+			autosaves = [a for a in files if a.startswith(prefix)]
+			autosaves.sort(key=lambda a: os.path.getmtime(self._fname(a)))
+			nxt = 0
+			if autosaves:
+				nxt = (int(autosaves[-1][len(prefix):-4]) + 1) % self.AUTOSAVES
+			idx["profiles"][obj.get("name", f)] = {"id": pid, "file": f,
+					"saved": saved, "summary": self.summary(obj),
+					"autosaves": autosaves, "next_auto": nxt}
+			idx["next_id"] = max(idx["next_id"], pid + 1)
+		return idx
+
+	def summary(self, obj):
+		return {k: obj.get(k, None) for k in ("galaxy", "system", "bitcoin", "nrank")}
+
+	def get_profiles(self):
+		# (name, profile) pairs, the most recently saved first. Read again,
+		# other games may have added profiles.
+		self.writer.flush()
+		pr = self.get_index(reload=True)["profiles"]
+		return sorted(pr.items(), key=lambda p: -p[1]["saved"])
+
+	def has_profile(self, name):
+		return name in self.get_index()["profiles"]
+
+	def load(self, name, autosave=None):
+		# Latest save of a profile, or one of its autosaves, 0 being the
+		# most recent. Returns None for a profile that was never saved.
+		self.writer.flush() # It might not be on disk yet
+		p = self.get_index()["profiles"].get(name, None)
+		if p is None:
+			return None
+		if autosave is None:
+			fname = self._fname(p["file"])
+		else:
+			fname = self._fname(p["autosaves"][-1 - autosave])
+		with open(fname, "rb") as f:
+			buf = f.read()
+		obj = loads(buf)
+		if autosave is None:
+			self.last[name] = buf
+		return obj
+
+	def save(self, name, obj):
+		# Encoded right away, the store is updated on the writer thread.
+		buf = dumps(obj)
+		if self.last.get(name, None) == buf:
+			return False # Nothing changed
+		self.last[name] = buf
+		self.writer.submit(self._save, name, buf, self.summary(obj))
+		return True
+
+	def _save(self, name, buf, summary):
+		try:
+			os.makedirs(self.path, exist_ok=True)
+			with self.locked():
+				idx = self.read_index()
+				p = idx["profiles"].get(name, None)
+				if p is None:
+					pid = idx["next_id"]
+					idx["next_id"] = pid + 1
+					p = {"id": pid, "file": "cmdr-{}.sav".format(pid), "saved": 0.0,
+							"summary": None, "autosaves": [], "next_auto": 0}
+					idx["profiles"][name] = p
+				write_atomic(self._fname(p["file"]), buf)
+				auto = "cmdr-{}-auto{}.sav".format(p["id"], p["next_auto"])
+				write_atomic(self._fname(auto), buf)
+				if auto in p["autosaves"]:
+					p["autosaves"].remove(auto)
+				p["autosaves"].append(auto)
+				p["next_auto"] = (p["next_auto"] + 1) % self.AUTOSAVES
+				p["saved"] = time()
+				p["summary"] = summary
+				# Written after the saved games, so it never lists a missing file.
+				write_atomic(self._fname(self.INDEX), dumps(idx))
+				self.index = idx
+		except (OSError, SaveError) as e:
+			# Try again on the next save
+			self.last.pop(name, None)
+			print("Saving {} failed: {}".format(name, e), file=sys.stderr)
+			return False
+		return True
+
+if __name__ == "__main__":
+	if len(sys.argv) < 2:
+		print("Usage: {} <saved game> [<json file>]".format(sys.argv[0]))
+		sys.exit(1)
+	try:
+		obj = read(sys.argv[1])
+	except (OSError, SaveError) as e:
+		print("Cannot read {}: {}".format(sys.argv[1], e))
+		sys.exit(1)
+	txt = export_json(obj, sys.argv[2] if len(sys.argv) > 2 else None)
+	if txt is not None:
+		print(txt)
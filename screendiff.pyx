@@ -19,6 +19,7 @@
 
 cimport cython
 from libc.stdio cimport printf, fflush, stdout
+from libc.string cimport memcpy
 from time import monotonic, process_time
 
 cdef class ScreenDiff:
@@ -26,10 +27,12 @@ cdef class ScreenDiff:
 	cdef char * _cmap0
 	cdef char * _ccolormap
 	cdef char * _ccolormap0
+	cdef char * _cstatic
 	cdef unsigned int _cwidth, _cheight
 	cdef unsigned int _buflen
 	cdef object _cmap_back, _cmap0_back
 	cdef object _ccolormap_back, _ccolormap0_back
+	cdef object _cstatic_back
 	cdef list _charcodes
 	cdef bint _showfps
 	cdef float _tscpu, _ts, _fps, _fpscount, _cpuload
@@ -54,6 +57,8 @@ cdef class ScreenDiff:
 		self._ccolormap0_back = bytearray(b'\x00' * size)
 		self._ccolormap = <char *>self._ccolormap_back
 		self._ccolormap0 = <char *>self._ccolormap0_back
+		self._cstatic_back = bytearray(b'\x00' * size)
+		self._cstatic = <char *>self._cstatic_back
 
 	cpdef object _get_map(self):
 		return self._cmap_back
@@ -66,6 +71,14 @@ cdef class ScreenDiff:
 		for i in range(self._buflen):
 			self._cmap[i] = 0
 
+	cpdef store_static(self):
+		# Keep a copy of the current map as static layer, so that it can
+		# be used instead of an empty map on each frame.
+		memcpy(self._cstatic, self._cmap, self._buflen)
+
+	cpdef restore_static(self):
+		memcpy(self._cmap, self._cstatic, self._buflen)
+
 	cpdef clearcolormap(self):
 		cdef unsigned int i
 		for i in range(self._buflen):
@@ -22,6 +22,10 @@ extensions = [
 	Extension("screendiff",
 		['screendiff.pyx'],
 		libraries=["m"]),
+	Extension("synthkernel",
+		['synthkernel.pyx'],
+		libraries=["m"],
+		extra_compile_args=["-ffp-contract=off"]), # Same rounding as Python
 ]
 
 setup(
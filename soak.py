@@ -0,0 +1,237 @@
+#
+# Copyright (c) 2021 David Jander <djander@gmail.com>
+#
+# This file is part of CBGElite.
+#
+# CBGElite is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, version 2 of the License.
+#
+# CBGElite is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with CBGElite.  If not, see <http://www.gnu.org/licenses/>.
+
+import os
+import gc
+import json
+import atexit
+import random
+import asyncio
+import resource
+from math import sqrt
+from control import BaseDev
+
+# Scenario files are JSON objects with these members:
+#
+#	seed: Random seed for the game and the random steps.
+#	start: List of steps run once at the beginning.
+#	steps: List of steps run after that.
+#	repeat: If true, steps is repeated forever.
+#	duration: Optional run time in seconds, after which the game exits.
+#	fast: If true, run as fast as possible instead of 25 frames/s.
+#
+# Each step has an action, the number of ticks it lasts and an optional
+# throttle. The actions are:
+#
+#	press: Press key (esc, 0-9, space) or button (see BUTTONS).
+#	jump, hyperspace: Press the respective button.
+#	fly_to: Steer towards target (station, planet, sun or nearest).
+#	fire: Fire lasers, aiming at the nearest ship if aim is true.
+#	random: Random stick movements and occasional random buttons.
+#	wait: Do nothing.
+KEYS = {"esc": 1, "1": 2, "2": 3, "3": 4, "4": 5, "5": 6, "6": 7, "7": 8,
+		"8": 9, "9": 10, "0": 11, "space": 57}
+
+BUTTONS = {
+	"fire": BaseDev.BTN_FIRE,
+	"missile_arm": BaseDev.BTN_MISSILE1,
+	"missile_launch": BaseDev.BTN_MISSILE2,
+	"ecm": BaseDev.BTN_ECM,
+	"jump": BaseDev.BTN_JUMP,
+	"hyperspace": BaseDev.BTN_HYPERSPACE,
+	"view_front": BaseDev.BTN_VIEW_FRONT,
+	"view_rear": BaseDev.BTN_VIEW_REAR,
+	"view_right": BaseDev.BTN_VIEW_RIGHT,
+	"view_left": BaseDev.BTN_VIEW_LEFT
+}
+
+def clamp(v):
+	return max(-1.0, min(1.0, v))
+
+# Input device that flies according to a scenario file.
+class SyntheticDev(BaseDev):
+	def __init__(self, elite, fname, on_end=None):
+		super().__init__()
+		with open(fname, "r") as f:
+			sc = json.load(f)
+		self.elite = elite
+		self.on_end = on_end
+		self.seed = sc.get("seed", 0)
+		self.rng = random.Random(self.seed)
+		random.seed(self.seed)
+		self.plan = list(sc.get("start", []))
+		self.steps = sc.get("steps", [])
+		self.repeat = sc.get("repeat", False)
+		self.duration = sc.get("duration", None)
+		self.fast = sc.get("fast", False)
+		self.t0 = None
+		self.step = None
+		self.stepticks = 0
+		self.ticks = 0
+
+	def next_step(self):
+		if not self.plan and self.steps:
+			self.plan = list(self.steps)
+			if not self.repeat:
+				self.steps = None
+		if not self.plan:
+			self.step = None
+			return
+		self.step = self.plan.pop(0)
+		self.ticks = 0
+		self.stepticks = max(1, self.step.get("ticks", 2 if self.step["action"] in ("press", "jump", "hyperspace") else 1))
+
+	def get_microverse(self):
+		cockpit = getattr(self.elite, "cockpit", None)
+		if cockpit is None:
+			return None
+		return cockpit.m
+
+	def get_target(self, name):
+		m = self.get_microverse()
+		if m is None:
+			return None
+		if name == "nearest":
+			ships = [o for o in m.get_objects() if o is not m.station]
+			if not ships:
+				return None
+			return min(ships, key=lambda o: o.distance)
+		return getattr(m, name, None)
+
+	def steer(self, pos):
+		# Roll the target into the vertical plane, then pitch it to the
+		# center of the view.
+		x, y, z = pos
+		d = sqrt(x * x + y * y + z * z) or 1.0
+		sy = 1.0 if y >= 0 else -1.0
+		self.roll = clamp(4.0 * sy * x / d)
+		if z > 0:
+			self.pitch = clamp(4.0 * y / d)
+		else:
+			self.pitch = sy
+
+	def handle(self):
+		now = self.elite.loop.time()
+		if self.t0 is None:
+			self.t0 = now
+		self.roll = 0.0
+		self.pitch = 0.0
+		self.btns = set()
+		self.keys = set()
+		while self.step is None or self.ticks >= self.stepticks:
+			self.next_step()
+			if self.step is None:
+				break
+		if self.step is None or (self.duration is not None and now - self.t0 >= self.duration):
+			if self.on_end is not None:
+				self.on_end()
+			return
+		st = self.step
+		getattr(self, "do_" + st["action"])(st)
+		self.throttle = st.get("throttle", self.throttle)
+		self.ticks += 1
+
+	def do_press(self, st):
+		# Hold down until the last tick, so that repeated presses are seen
+		# as new ones.
+		if self.ticks >= self.stepticks - 1:
+			return
+		if "key" in st:
+			self.keys.add(KEYS[st["key"]])
+		if "button" in st:
+			self.btns.add(BUTTONS[st["button"]])
+
+	def do_jump(self, st):
+		self.do_press({"button": "jump"})
+
+	def do_hyperspace(self, st):
+		self.do_press({"button": "hyperspace"})
+
+	def do_fly_to(self, st):
+		t = self.get_target(st.get("target", "station"))
+		if t is not None:
+			self.steer(t.pos)
+
+	def do_fire(self, st):
+		if st.get("aim", False):
+			self.do_fly_to({"target": "nearest"})
+		self.btns.add(self.BTN_FIRE)
+
+	def do_random(self, st):
+		rng = self.rng
+		self.roll = rng.uniform(-1.0, 1.0)
+		self.pitch = rng.uniform(-1.0, 1.0)
+		if rng.random() < 0.02:
+			self.btns.add(rng.choice(list(BUTTONS.values())))
+
+	def do_wait(self, st):
+		pass
+
+# Writes frame times, memory usage and the number of asyncio tasks to a
+# CSV file every interval seconds.
+class SoakStats:
+	def __init__(self, loop, fname, interval=60.0):
+		self.loop = loop
+		self.interval = interval
+		self.f = open(fname, "w")
+		self.f.write("time,frames,frame_avg_ms,frame_max_ms,rss_kb,objects,tasks\n")
+		self.t0 = loop.time()
+		self.tnext = self.t0 + interval
+		self.twake = None
+		self.reset()
+		atexit.register(self.close)
+
+	def reset(self):
+		self.frames = 0
+		self.busy = 0.0
+		self.busymax = 0.0
+
+	def get_rss(self):
+		try:
+			with open("/proc/self/statm", "r") as f:
+				return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") // 1024
+		except OSError:
+			return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+	def frame_start(self, now):
+		self.twake = now
+
+	def frame_done(self, now):
+		if self.twake is not None:
+			dt = now - self.twake
+			self.busy += dt
+			self.busymax = max(self.busymax, dt)
+			self.frames += 1
+			self.twake = None
+		if now >= self.tnext:
+			self.report(now)
+			self.tnext += self.interval
+
+	def report(self, now):
+		avg = self.busy / self.frames if self.frames else 0.0
+		tasks = len(asyncio.all_tasks(self.loop))
+		self.f.write("{:.1f},{},{:.2f},{:.2f},{},{},{}\n".format(now - self.t0,
+				self.frames, avg * 1000, self.busymax * 1000, self.get_rss(),
+				len(gc.get_objects()), tasks))
+		self.f.flush()
+		self.reset()
+
+	def close(self):
+		if not self.f.closed:
+			if self.frames:
+				self.report(self.loop.time())
+			self.f.close()
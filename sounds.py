@@ -16,51 +16,276 @@
 # You should have received a copy of the GNU General Public License
 # along with CBGElite.  If not, see <http://www.gnu.org/licenses/>.
 
-import alsaaudio
+import os
+import mmap
+import wave
+import atexit
 import random
 import struct
+import zlib
 import asyncio
+import tempfile
+import inspect
+import hashlib
+from array import array
 from time import monotonic
+import synthkernel
+
+CACHE_FILE = os.path.join(os.path.expanduser("~"), ".cbgelite-sounds.cache")
+CACHE_VERSION = 2
+NOISE_SEED = 0x5eed
+
+# A sound played by the Mixer: a s16le stereo buffer, or two mono buffers
+# that are mixed with the given gains while playing.
+class Voice:
+	def __init__(self, priority, buf=None, src=None, gains=None):
+		self.priority = priority
+		self.gains = gains
+		if src is None:
+			self.buf = memoryview(buf)
+			self.src = None
+			self.nframes = len(buf) // 4
+		else:
+			self.buf = None
+			self.src = (memoryview(src[0]), memoryview(src[1]))
+			self.nframes = len(src[0])
+		self.pos = 0
+		self.busy = True
 
-class SoundPlayer:
-	def __init__(self, loop):
-		self.loop = loop
-		pcms = alsaaudio.pcms()
-		if "pulse" in pcms:
-			device = "pulse"
+	def stop_play(self):
+		self.busy = False
+
+	def remaining(self):
+		return self.nframes - self.pos
+
+	def render(self, acc, n):
+		# Add the next n frames to the accumulator
+		f0 = self.pos
+		f1 = min(f0 + n, self.nframes)
+		if self.src is None:
+			synthkernel.add_s16le_2ch(acc, self.buf[f0 * 4:f1 * 4])
 		else:
-			device = "default"
+			b0, b1 = self.src
+			synthkernel.add_mix_2ch(acc, b0[f0:f1], b1[f0:f1], *self.gains)
+		self.pos = f1
+		if f1 >= self.nframes:
+			self.busy = False
+
+# Audio output that discards everything. Outputs without a file descriptor
+# to poll are paced by a timer, one period at a time.
+class NullOutput:
+	discards = True
+
+	def __init__(self, channels, rate, periodsize):
+		self.framelen = channels * 2
+		self.rate = rate
+
+	def fileno(self):
+		return None
+
+	def start(self):
+		pass
+
+	def write(self, data):
+		return len(data) // self.framelen
+
+	def xrun(self):
+		return False
+
+	def close(self):
+		pass
+
+# Writes the sound into a WAV file, with silence in the pauses so the timing
+# is kept.
+class WavOutput(NullOutput):
+	discards = False
+
+	def __init__(self, channels, rate, periodsize, fname, clock=monotonic):
+		super().__init__(channels, rate, periodsize)
+		self.clock = clock
+		self.wav = wave.open(fname, "wb")
+		self.wav.setnchannels(channels)
+		self.wav.setsampwidth(2)
+		self.wav.setframerate(rate)
+		self.t0 = None
+		self.nframes = 0
+		atexit.register(self.close)
+
+	def start(self):
+		now = self.clock()
+		if self.t0 is None:
+			self.t0 = now
+		gap = int((now - self.t0) * self.rate) - self.nframes
+		if gap > 0:
+			self.wav.writeframesraw(bytes(gap * self.framelen))
+			self.nframes += gap
+
+	def write(self, data):
+		self.wav.writeframesraw(data)
+		n = len(data) // self.framelen
+		self.nframes += n
+		return n
+
+	def close(self):
+		self.wav.close()
+
+class AlsaOutput:
+	discards = False
+
+	def __init__(self, channels, rate, periodsize):
+		try:
+			import alsaaudio
+		except ImportError:
+			raise OSError("alsaaudio is not installed")
+		try:
+			pcms = alsaaudio.pcms()
+			if "pulse" in pcms:
+				device = "pulse"
+			else:
+				device = "default"
+			self.pcm = alsaaudio.PCM(mode=alsaaudio.PCM_NONBLOCK, device=device)
+			self.pcm.setchannels(channels)
+			self.pcm.setperiodsize(periodsize)
+		except alsaaudio.ALSAAudioError as e:
+			raise OSError("Cannot open ALSA PCM: {}".format(e))
+		self.pcmfd = self.pcm.polldescriptors()[0]
+		# Underruns can only be seen with pyalsaaudio >= 0.9, which has
+		# PCM.state().
+		self.xrun_state = getattr(alsaaudio, "PCM_STATE_XRUN", None)
+		if not hasattr(self.pcm, "state"):
+			self.xrun_state = None
+
+	def fileno(self):
+		return self.pcmfd[0]
+
+	def start(self):
+		pass
+
+	def write(self, data):
+		return self.pcm.write(data)
+
+	def xrun(self):
+		return self.xrun_state is not None and self.pcm.state() == self.xrun_state
+
+	def close(self):
+		self.pcm.close()
+
+# Opens an audio output, spec is "alsa", "null" or "wav:FILENAME".
+def open_output(spec, channels=2, rate=44100, periodsize=1024):
+	if spec == "alsa":
+		return AlsaOutput(channels, rate, periodsize)
+	elif spec == "null":
+		return NullOutput(channels, rate, periodsize)
+	elif spec.startswith("wav:"):
+		return WavOutput(channels, rate, periodsize, spec[4:])
+	raise ValueError("Unknown audio output: {}".format(spec))
+
+# Plays up to voices sounds at once on one output. When all are in use, the
+# oldest one with the lowest priority makes room, unless its priority is higher.
+class Mixer:
+	def __init__(self, loop, out, voices=8, rate=44100):
+		self.loop = loop
+		self.out = out
 		self.channels = 2
 		self.wordsize = 2
 		self.periodsize = 1024
-		self.pcm = alsaaudio.PCM(mode=alsaaudio.PCM_NONBLOCK, device=device)
-		self.pcm.setchannels(self.channels)
-		self.pcm.setperiodsize(self.periodsize)
-		self.pcmfd = self.pcm.polldescriptors()[0]
+		self.fd = out.fileno()
+		self.timer = None
+		self.periodtime = self.periodsize / rate
 		self.framelen = self.channels * self.wordsize
 		self.periodlen = self.periodsize * self.framelen
-		self.busy = False
+		self.maxvoices = voices
+		self.voices = []
+		self.silence = array('i', bytes(4 * self.channels * self.periodsize))
+		self.acc = array('i', self.silence)
+		self.period = bytearray(self.periodlen)
+		self.view = memoryview(self.period)
+		self.pending = self.view[:0]
+		self.running = False
+		self.writes = 0
+		self.partial_writes = 0
+		self.underruns = 0
+
+	def add_voice(self, voice):
+		self.voices = [v for v in self.voices if v.busy]
+		if len(self.voices) >= self.maxvoices:
+			victim = min(self.voices, key=lambda v: v.priority)
+			if victim.priority > voice.priority:
+				return None
+			victim.stop_play()
+			self.voices.remove(victim)
+		self.voices.append(voice)
+		if not self.running:
+			self.running = True
+			self.out.start()
+			if self.fd is None:
+				self.timer_handler()
+			else:
+				self.play_handler()
+				# NOTE: Although we write to the alsa pcm device, the POLL mask alsa
+				# returns has POLLIN set instead of POLLOUT, so we need to add a reader.
+				self.loop.add_reader(self.fd, self.play_handler)
+		return voice
+
+	def play(self, buf, priority=0):
+		return self.add_voice(Voice(priority, buf=buf))
+
+	def play_mix(self, buf0, buf1, gains, priority=0):
+		return self.add_voice(Voice(priority, src=(buf0, buf1), gains=gains))
+
+	def stop(self):
+		if self.fd is None:
+			if self.timer is not None:
+				self.timer.cancel()
+				self.timer = None
+		else:
+			self.loop.remove_reader(self.fd)
+		self.running = False
 
-	def start_play(self, buf):
-		self.buf = buf
-		self.pos = 0
+	def timer_handler(self):
+		self.timer = self.loop.call_later(self.periodtime, self.timer_handler)
 		self.play_handler()
-		# NOTE: Although we write to the alsa pcm device, the POLL mask alsa
-		# returns has POLLIN set instead of POLLOUT, so we need to add a reader.
-		self.loop.add_reader(self.pcmfd[0], self.play_handler)
-		self.busy = True
 
-	def stop_play(self):
-		self.loop.remove_reader(self.pcmfd[0])
-		self.busy = False
+	def get_stats(self):
+		return {"writes": self.writes, "partial_writes": self.partial_writes,
+				"underruns": self.underruns, "voices": len(self.voices)}
+
+	def render_period(self):
+		# Mix the next period into the preallocated period buffer and
+		# return a view of the part that is used.
+		voices = self.voices
+		if not all(v.busy for v in voices):
+			voices = self.voices = [v for v in voices if v.busy]
+		if not voices:
+			return None
+		n = min(self.periodsize, max(v.remaining() for v in voices))
+		acc = self.acc
+		acc[:] = self.silence
+		for v in voices:
+			v.render(acc, n)
+		pending = self.view[:n * self.framelen]
+		synthkernel.acc_to_s16le(acc, pending)
+		return pending
 
 	def play_handler(self):
-		beg = self.pos
-		end = beg + self.periodlen
-		n = self.pcm.write(self.buf[beg:end])
-		self.pos += n * self.framelen
-		if self.pos >= len(self.buf):
-			self.stop_play()
+		if not self.pending:
+			self.pending = self.render_period()
+			if self.pending is None:
+				self.pending = self.view[:0]
+				self.stop()
+				return
+		if self.out.xrun():
+			self.underruns += 1
+		n = self.out.write(self.pending)
+		self.writes += 1
+		if n < 0:
+			n = 0
+		nb = n * self.framelen
+		if nb < len(self.pending):
+			self.partial_writes += 1
+		# Whatever was not written stays in the period buffer for the next
+		# call, without copying.
+		self.pending = self.pending[nb:]
 
 class ADSR:
 	def __init__(self, delay, a, d, sl, st, r):
@@ -96,15 +321,15 @@ class ADSR:
 	def ramp(self, buf, start, duration, v0, v1):
 		n = self.nsamples(duration)
 		m = (v1 - v0) / n
-		for t in range(n):
-			i = t + start
-			buf[i] = int(buf[i] * (v0 + m * t))
-		return start + n
+		return synthkernel.ramp(buf, start, n, v0, m)
 
 class SynthVoice:
-	def __init__(self):
+	def __init__(self, seed=NOISE_SEED):
 		self.rate = 44100 # FIXME
 		self.maxamp = 20000
+		# Own generator for the noise, so the samples are always the same
+		# and the game's random sequence is left alone.
+		self.rng = random.Random(seed)
 
 	def nsamples(self, time):
 		return int(self.rate * time)
@@ -118,66 +343,39 @@ class SynthVoice:
 		pern1 = self.rate / fend
 		ntotal = adsr.nsamples(adsr.time) + 1
 		perm = (pern1 - pern0) / ntotal
-		pc = 0
-		buf = []
-		v = self.maxamp
-		l0 = v
-		l1 = -v
-		for t in range(ntotal):
-			if pc > hpern:
-				buf.append(l0)
-			else:
-				buf.append(l1)
-			pc += 1.0
-			if pc > pern:
-				pc -= pern
-				pern = pern0 + t * perm
-				hpern = pern * dc
-				if noise:
-					l0 = random.randint(-v, v)
-					l1 = random.randint(-v, v)
+		buf = array('d', bytes(8 * ntotal))
+		synthkernel.square(buf, pern0, perm, dc, self.maxamp, noise, self.rng.randint)
 		adsr.process(buf)
 		if ac0 is not None:
 			self.filter_lp(buf, ac0)
 		return buf
 
 	def filter_lp(self, buf, ac0):
-		gain = 2/(1+ac0)
-		xv1 = xv0 = 0
-		yv1 = yv0 = 0
-		for i in range(len(buf)):
-			xv0 = xv1
-			xv1 = buf[i] / gain
-			yv0 = yv1
-			out = xv0 + xv1 - yv0 * ac0
-			yv1 = out
-			buf[i] = out
+		synthkernel.filter_lp(buf, ac0)
 
 	def render_s16le_2ch(self, buf, vol=1.0, pan=0.0):
-		pack_into = struct.Struct('<hh').pack_into
 		out = bytearray(4*len(buf))
 		vl = min(1.0, 1.0-pan) * vol
 		vr = min(1.0, 1.0+pan) * vol
-		for i,v in enumerate(buf):
-			pack_into(out, i*4, int(vl * v), int(vr * v))
+		synthkernel.render_s16le_2ch(buf, out, vl, vr)
 		return out
 
-	def mix_s16le_2ch(self, buf0, buf1, vol0=1.0, vol1=1.0, pan0=0.0, pan1=0.0):
-		pack_into = struct.Struct('<hh').pack_into
-		out = bytearray(4*len(buf0))
+	def mix_gains(self, vol0=1.0, vol1=1.0, pan0=0.0, pan1=0.0):
 		vol0 /= 2
 		vol1 /= 2
 		vl0 = min(1.0, 1.0-pan0) * vol0
 		vr0 = min(1.0, 1.0+pan0) * vol0
 		vl1 = min(1.0, 1.0-pan1) * vol1
 		vr1 = min(1.0, 1.0+pan1) * vol1
-		for i, (v0, v1) in enumerate(zip(buf0, buf1)):
-			pack_into(out, i*4, int(vl0 * v0 + vl1 * v1), int(vr0 * v0 + vr1 * v1))
+		return vl0, vr0, vl1, vr1
+
+	def mix_s16le_2ch(self, buf0, buf1, vol0=1.0, vol1=1.0, pan0=0.0, pan1=0.0):
+		out = bytearray(4*len(buf0))
+		synthkernel.mix_s16le_2ch(buf0, buf1, out, *self.mix_gains(vol0, vol1, pan0, pan1))
 		return out
 
 	async def test(self, loop):
-		s = SoundPlayer(loop)
-		s2= SoundPlayer(loop)
+		mixer = Mixer(loop, open_output("alsa"))
 		adsr = ADSR(0.0, 0.0, 0.2, 0.1, 0.05, 0.05)
 		buf0 = self.gen_square(330.0, 55, 0.3, adsr, noise=True)
 		buf1 = self.gen_square(330.0, 55, 0.3, adsr)
@@ -187,30 +385,175 @@ class SynthVoice:
 			dt = monotonic() - t0
 			print(repr(dt))
 			out2 = self.mix_s16le_2ch(buf0, buf1, 1.0, 0.6, -0.8, 0.4)
-			s.start_play(out)
+			s = mixer.play(out)
 			await asyncio.sleep(0.05)
-			s2.start_play(out2)
+			mixer.play(out2)
 			while s.busy:
 				await asyncio.sleep(0.02)
-			out = self.mix_s16le_2ch(buf0, buf1, 0.0, 1.0, -0.2, 0.2)
-			s.start_play(out)
+			s = mixer.play_mix(buf0, buf1, self.mix_gains(0.0, 1.0, -0.2, 0.2))
 			while s.busy:
 				await asyncio.sleep(0.02)
-			out = self.mix_s16le_2ch(buf0, buf1, 0.6, 0.6, -0.2, 0.2)
-			s.start_play(out)
+			s = mixer.play_mix(buf0, buf1, self.mix_gains(0.6, 0.6, -0.2, 0.2))
 			while s.busy:
 				await asyncio.sleep(0.02)
 
+# Rendered samples in a memory mapped file, so they need not be synthesized
+# on every start. Tagged with a key of the synthesis code, and ended by a
+# crc32 of everything before it. Mono samples are doubles, stereo s16le.
+class SampleCache:
+	header = struct.Struct("<4sH20sH")
+	entry = struct.Struct("<16scxxxI")
+	trailer = struct.Struct("<I")
+	MAGIC = b"CBGS"
+
+	def __init__(self, fname, key):
+		self.fname = fname
+		self.key = key
+
+	def load(self):
+		try:
+			with open(self.fname, "rb") as f:
+				mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+		except (OSError, ValueError):
+			return None
+		try:
+			magic, version, key, n = self.header.unpack_from(mm, 0)
+			if magic != self.MAGIC or version != CACHE_VERSION or key != self.key:
+				return None
+			end = len(mm) - self.trailer.size
+			crc, = self.trailer.unpack_from(mm, end)
+			if zlib.crc32(memoryview(mm)[:end]) != crc:
+				return None
+			mv = memoryview(mm)
+			pos = self.header.size
+			ret = {}
+			for i in range(n):
+				name, typ, length = self.entry.unpack_from(mm, pos)
+				pos += self.entry.size
+				data = mv[pos:pos + length]
+				if typ == b'd':
+					data = data.cast('d')
+				ret[name.rstrip(b'\0').decode("ascii")] = data
+				pos += (length + 7) & ~7
+		except (struct.error, ValueError):
+			return None
+		return ret
+
+	def save(self, samples):
+		# Written to a unique temporary file next to the cache, so that
+		# concurrent starts never write into the same file.
+		fd, tmp = tempfile.mkstemp(prefix=os.path.basename(self.fname) + ".",
+				dir=os.path.dirname(os.path.abspath(self.fname)))
+		try:
+			with os.fdopen(fd, "wb") as f:
+				crc = 0
+				def write(b):
+					nonlocal crc
+					crc = zlib.crc32(b, crc)
+					f.write(b)
+				write(self.header.pack(self.MAGIC, CACHE_VERSION, self.key, len(samples)))
+				for name, data in samples.items():
+					if isinstance(data, (bytes, bytearray)):
+						typ = b'B'
+					else:
+						typ = b'd'
+						data = array('d', data).tobytes()
+					write(self.entry.pack(name.encode("ascii"), typ, len(data)))
+					write(data)
+					write(bytes(-len(data) & 7))
+				f.write(self.trailer.pack(crc))
+			os.replace(tmp, self.fname)
+		except BaseException:
+			try:
+				os.unlink(tmp)
+			except OSError:
+				pass
+			raise
+
 class SoundFX:
-	def __init__(self, loop=None):
-		self.loop = loop or asyncio.get_event_loop()
-		self.players = [
-				SoundPlayer(self.loop),
-				SoundPlayer(self.loop),
-				SoundPlayer(self.loop)
-			]
+	SAMPLES = ("laser1", "laser2", "laser_long", "damage", "mlaunch1", "mlaunch2",
+			"exp_short", "myshot", "myhit", "jump1", "jumpabrt", "exp", "launch",
+			"hyp1", "hyp2", "beep", "boop", "ecm")
+
+	# Priorities of the effects, for when the mixer runs out of voices.
+	PRIO_LOW = 0
+	PRIO_NORMAL = 1
+	PRIO_HIGH = 2
+
+	def __init__(self, loop=None, voices=8):
+		# Nothing is opened or synthesized before the first sound is played.
+		self.loop = loop
+		self.voices = voices
+		self.out = None
+		self.mixer = None
+		self.loaded = False
 		self.synth = SynthVoice()
+
+	def __getattr__(self, name):
+		# Samples are loaded when first used. Nothing is loaded if the
+		# output discards the sound anyway.
+		if name in SoundFX.SAMPLES:
+			if self.discards():
+				return None
+			if not self.__dict__.get("loaded", True):
+				self.load_samples()
+				return getattr(self, name)
+		raise AttributeError(name)
+
+	def set_output(self, spec):
+		# Select the audio output. Must be called before playing sounds.
+		self.out = open_output(spec, rate=self.synth.rate)
+
+	def discards(self):
+		out = self.__dict__.get("out", None)
+		return out is not None and out.discards
+
+	def get_mixer(self):
+		if self.mixer is None:
+			if self.out is None:
+				self.set_output("alsa")
+			loop = self.loop or asyncio.get_event_loop()
+			self.mixer = Mixer(loop, self.out, self.voices, self.synth.rate)
+		return self.mixer
+
+	def close(self):
+		if self.mixer is not None:
+			self.mixer.stop()
+		if self.out is not None:
+			self.out.close()
+
+	def samples_key(self):
+		h = hashlib.sha1()
+		h.update(repr((CACHE_VERSION, synthkernel.KERNEL_VERSION,
+				self.synth.rate, self.synth.maxamp, NOISE_SEED)).encode())
+		for o in (ADSR, SynthVoice, SoundFX.generate_samples):
+			h.update(inspect.getsource(o).encode())
+		# The kernel source too, if it is next to us (built in place).
+		pyx = os.path.join(os.path.dirname(os.path.abspath(__file__)), "synthkernel.pyx")
+		try:
+			with open(pyx, "rb") as f:
+				h.update(f.read())
+		except OSError:
+			pass
+		return h.digest()
+
+	def load_samples(self):
+		try:
+			cache = SampleCache(CACHE_FILE, self.samples_key())
+		except OSError:
+			cache = None # No source code to hash, don't cache.
+		samples = cache and cache.load()
+		self.loaded = True
+		if samples is not None and all(n in samples for n in self.SAMPLES):
+			for n in self.SAMPLES:
+				setattr(self, n, samples[n])
+			return
 		self.generate_samples()
+		if cache is not None:
+			try:
+				cache.save({n: getattr(self, n) for n in self.SAMPLES})
+			except OSError:
+				pass
 
 	def generate_samples(self):
 		adsr = ADSR(0.0, 0.0, 0.2, 0.1, 0.05, 0.1)
@@ -269,8 +612,8 @@ class SoundFX:
 				self.synth.gen_square(220, 220, 0.45, ADSR(0, 0, 0.1, 0.6, 0.05, 0.1), noise=False, ac0=-0.85),
 				vol=0.5)
 		ecm_sub_adsr = ADSR(0.0, 0.0, 0.02, 0.5, 0.03, 0.01)
-		ecmttot = []
-		ecmbtot = []
+		ecmttot = array('d')
+		ecmbtot = array('d')
 		t = 1
 		for tfreq in range(1320, 720, -20):
 			bfreq = tfreq / 3
@@ -283,8 +626,7 @@ class SoundFX:
 	def play_shot(self, pan=0.0):
 		pan0 = max(-1.0, pan - 0.2)
 		pan1 = min(1.0, pan + 0.2)
-		buf = self.synth.mix_s16le_2ch(self.laser1, self.laser2, 0.1, 0.1, pan0, pan1)
-		return self.play(buf)
+		return self.play_mix(self.laser1, self.laser2, 0.1, 0.1, pan0, pan1, self.PRIO_LOW)
 
 	def play_myshot(self):
 		return self.play(self.myshot)
@@ -292,21 +634,20 @@ class SoundFX:
 	def play_myhit(self):
 		return self.play(self.myhit)
 
-	def play(self, buf, force=False):
-		for p in self.players:
-			if not p.busy:
-				p.start_play(buf)
-				return p
-		if force:
-			self.players[-1].start_play(buf)
-			return self.players[-1]
-		return None
+	def play(self, buf, priority=PRIO_NORMAL):
+		if self.discards():
+			return None
+		return self.get_mixer().play(buf, priority)
+
+	def play_mix(self, buf0, buf1, vol0, vol1, pan0, pan1, priority=PRIO_NORMAL):
+		if self.discards():
+			return None
+		return self.get_mixer().play_mix(buf0, buf1, self.synth.mix_gains(vol0, vol1, pan0, pan1), priority)
 
 	def play_hit(self, pan=0.0):
 		pan0 = max(-1.0, pan - 0.2)
 		pan1 = min(1.0, pan + 0.2)
-		buf = self.synth.mix_s16le_2ch(self.laser_long, self.damage, 0.5, 1.0, pan0, pan1)
-		return self.play(buf)
+		return self.play_mix(self.laser_long, self.damage, 0.5, 1.0, pan0, pan1)
 
 	def play_jump(self):
 		return self.play(self.jump1)
@@ -315,25 +656,25 @@ class SoundFX:
 		return self.play(self.jumpabrt)
 
 	def play_explosion(self):
-		return self.play(self.exp, force=True)
+		return self.play(self.exp, self.PRIO_HIGH)
 
 	def play_short_explosion(self):
-		return self.play(self.exp_short, force=True)
+		return self.play(self.exp_short, self.PRIO_HIGH)
 
 	def play_launch(self):
 		return self.play(self.launch)
 
 	def play_hyperspace_start(self):
-		return self.play(self.hyp1, force=True)
+		return self.play(self.hyp1, self.PRIO_HIGH)
 
 	def play_hyperspace_end(self):
-		return self.play(self.hyp2, force=True)
+		return self.play(self.hyp2, self.PRIO_HIGH)
 
 	def play_beep(self):
-		return self.play(self.beep, force=True)
+		return self.play(self.beep, self.PRIO_HIGH)
 
 	def play_boop(self):
-		return self.play(self.boop, force=True)
+		return self.play(self.boop, self.PRIO_HIGH)
 
 	def play_ecm(self):
 		return self.play(self.ecm)
@@ -341,8 +682,7 @@ class SoundFX:
 	def play_missile_launch(self, pan=0.0):
 		pan0 = max(-1.0, pan - 0.2)
 		pan1 = min(1.0, pan + 0.2)
-		buf = self.synth.mix_s16le_2ch(self.mlaunch1, self.mlaunch2, 0.5, 0.5, pan0, pan1)
-		return self.play(buf)
+		return self.play_mix(self.mlaunch1, self.mlaunch2, 0.5, 0.5, pan0, pan1)
 
 if __name__ == "__main__":
 	loop = asyncio.get_event_loop()
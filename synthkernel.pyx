@@ -0,0 +1,147 @@
+#
+# Copyright (c) 2021 David Jander <djander@gmail.com>
+#
+# This file is part of CBGElite.
+#
+# CBGElite is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, version 2 of the License.
+#
+# CBGElite is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with CBGElite.  If not, see <http://www.gnu.org/licenses/>.
+
+#cython: language_level=3
+
+# Inner loops of the sound synthesizer. These work on array('d') buffers
+# and must give exactly the same results as the original Python code,
+# which is why floating point expressions are kept in the same order.
+
+cimport cython
+
+# Part of the key of the sample cache in sounds.py. Increment it whenever
+# the output of any of these functions changes.
+KERNEL_VERSION = 1
+
+@cython.boundscheck(False)
+@cython.wraparound(False)
+@cython.cdivision(True)
+def square(double[:] buf, double pern0, double perm, double dc, double v, bint noise, object randint):
+	# Square wave by phase counting, with linear period sweep. For noise,
+	# the levels are randomized on every period.
+	cdef Py_ssize_t t, n = buf.shape[0]
+	cdef double pc = 0.0
+	cdef double pern = pern0
+	cdef double hpern = pern * dc
+	cdef double l0 = v, l1 = -v
+	cdef long iv = <long>v
+	for t in range(n):
+		if pc > hpern:
+			buf[t] = l0
+		else:
+			buf[t] = l1
+		pc += 1.0
+		if pc > pern:
+			pc -= pern
+			pern = pern0 + t * perm
+			hpern = pern * dc
+			if noise:
+				l0 = randint(-iv, iv)
+				l1 = randint(-iv, iv)
+
+@cython.boundscheck(False)
+@cython.wraparound(False)
+def ramp(double[:] buf, Py_ssize_t start, Py_ssize_t n, double v0, double m):
+	# Multiply with a linear envelope segment, truncating like int().
+	cdef Py_ssize_t t, i
+	if n > buf.shape[0] - start:
+		n = buf.shape[0] - start
+	for t in range(n):
+		i = t + start
+		buf[i] = <double>(<long long>(buf[i] * (v0 + m * t)))
+	return start + n
+
+@cython.boundscheck(False)
+@cython.wraparound(False)
+@cython.cdivision(True)
+def filter_lp(double[:] buf, double ac0):
+	# First order IIR low pass filter
+	cdef double gain = 2.0 / (1.0 + ac0)
+	cdef double xv0, xv1 = 0.0, yv0, yv1 = 0.0, out
+	cdef Py_ssize_t i
+	for i in range(buf.shape[0]):
+		xv0 = xv1
+		xv1 = buf[i] / gain
+		yv0 = yv1
+		out = xv0 + xv1 - yv0 * ac0
+		yv1 = out
+		buf[i] = out
+
+cdef inline void put_s16le(unsigned char[:] out, Py_ssize_t i, double v):
+	cdef long long s = <long long>v
+	if s > 32767:
+		s = 32767
+	elif s < -32768:
+		s = -32768
+	out[i] = s & 0xff
+	out[i + 1] = (s >> 8) & 0xff
+
+@cython.boundscheck(False)
+@cython.wraparound(False)
+def render_s16le_2ch(const double[:] buf, unsigned char[:] out, double vl, double vr):
+	cdef Py_ssize_t i
+	cdef double v
+	for i in range(buf.shape[0]):
+		v = buf[i]
+		put_s16le(out, i * 4, vl * v)
+		put_s16le(out, i * 4 + 2, vr * v)
+
+@cython.boundscheck(False)
+@cython.wraparound(False)
+def mix_s16le_2ch(const double[:] buf0, const double[:] buf1, unsigned char[:] out,
+		double vl0, double vr0, double vl1, double vr1):
+	cdef Py_ssize_t i, n = min(buf0.shape[0], buf1.shape[0])
+	cdef double v0, v1
+	for i in range(n):
+		v0 = buf0[i]
+		v1 = buf1[i]
+		put_s16le(out, i * 4, vl0 * v0 + vl1 * v1)
+		put_s16le(out, i * 4 + 2, vr0 * v0 + vr1 * v1)
+	# Silence after the end of the shorter buffer
+	for i in range(n * 4, out.shape[0]):
+		out[i] = 0
+
+# Mixer stage: voices are added into an interleaved stereo accumulator of
+# ints, which is then saturated to s16le.
+
+@cython.boundscheck(False)
+@cython.wraparound(False)
+def add_s16le_2ch(int[:] acc, const unsigned char[:] src):
+	cdef Py_ssize_t i, n = min(src.shape[0] // 2, acc.shape[0])
+	cdef short s
+	for i in range(n):
+		s = <short>(src[2 * i] | (src[2 * i + 1] << 8))
+		acc[i] += s
+
+@cython.boundscheck(False)
+@cython.wraparound(False)
+def add_mix_2ch(int[:] acc, const double[:] buf0, const double[:] buf1,
+		double vl0, double vr0, double vl1, double vr1):
+	cdef Py_ssize_t i, n = min(buf0.shape[0], buf1.shape[0], acc.shape[0] // 2)
+	cdef double v0, v1
+	for i in range(n):
+		v0 = buf0[i]
+		v1 = buf1[i]
+		acc[2 * i] += <int>(vl0 * v0 + vl1 * v1)
+		acc[2 * i + 1] += <int>(vr0 * v0 + vr1 * v1)
+
+@cython.boundscheck(False)
+@cython.wraparound(False)
+def acc_to_s16le(const int[:] acc, unsigned char[:] out):
+	cdef Py_ssize_t i, n = min(acc.shape[0], out.shape[0] // 2)
+	for i in range(n):
+		put_s16le(out, 2 * i, acc[i])
@@ -16,9 +16,12 @@
 # along with CBGElite.  If not, see <http://www.gnu.org/licenses/>.
 
 class FontData:
+	RUNCACHE_MAX = 1024
 	def __init__(self, fname):
 		with open(fname, "rb") as f:
 			self.fontdata = f.read()
+		self.blank = bytes(8)
+		self.runcache = {}
 
 	def getglyph(self, code):
 		code ^= 256
@@ -34,7 +37,27 @@ class FontData:
 		elif 0x60 <= char <= 0x7f:
 			return self.getglyph(char - 0x60)
 
+	def getrun(self, s):
+		# Returns the upper and lower character cell rows of a whole string.
+		# Text is always drawn at character cell positions, so the result
+		# only depends on the string itself and can be cached.
+		run = self.runcache.get(s)
+		if run is not None:
+			return run
+		row0 = bytearray()
+		row1 = bytearray()
+		for c in s:
+			g = self.getchar(c) or self.blank
+			row0 += g[:4]
+			row1 += g[4:]
+		run = (bytes(row0), bytes(row1))
+		if len(self.runcache) >= self.RUNCACHE_MAX:
+			self.runcache.clear()
+		self.runcache[s] = run
+		return run
+
 	def optimize(self, bitmasks):
+		self.runcache.clear()
 		self.font = bytearray(b'\x00' * 8 * 512)
 		f = self.font
 		for c in range(512):
@@ -15,7 +15,8 @@
 # You should have received a copy of the GNU General Public License
 # along with CBGElite.  If not, see <http://www.gnu.org/licenses/>.
 
-from math import sqrt
+from math import sqrt, floor
+from array import array
 
 class SeedProcessor:
 	def __init__(self, seed):
@@ -148,8 +149,9 @@ class SeedProcessor:
 
 
 class System:
-	def __init__(self, sp, galaxy, index):
-		s = self.seed = sp.copy_seed()
+	def __init__(self, sp, galaxy, index, seed):
+		s = self.seed = list(seed)
+		self.sp = sp
 		self.galaxy = galaxy
 		self.index = index
 		self.x = s[1] >> 8
@@ -165,7 +167,7 @@ class System:
 		self.productivity = ((self.economy ^ 7) + 3) * (self.government + 4) * self.population * 8
 		self.population /= 10
 		self.radius = 256 * (((s[2] >> 8) & 0x0f) + 11) + self.x
-		sp.set_fastseed(s[1] & 0xff, s[1] >> 8, s[2] & 0xff, s[2] >> 8)
+		self.fastseed = (s[1] & 0xff, s[1] >> 8, s[2] & 0xff, s[2] >> 8)
 		if s[2] & 0x80:
 			self.species = ["Large ", "Fierce ", "Small ", "", "", "", "", ""][(s[2] >> 10) & 7]
 			self.species += ["Green ", "Red ", "Yellow ", "Blue ", "Black ", "Hamless ", "", ""][(s[2] >> 13) & 7]
@@ -174,14 +176,21 @@ class System:
 			self.species += ["Rodents", "Frogs", "Lizards", "Lobsters", "Birds", "Humanoids", "Felines", "Insects"][(aidx + ((s[2]>>8) & 3)) & 7]
 		else:
 			self.species = "Human Colonials"
-		self.name = sp.get_name(s).lower().capitalize()
-		self.description = sp.make_goatsoup("\x8F is \x97.", self)
+		self.name = sp.get_name(list(s)).lower().capitalize()
+		self._description = None
 		self.str_economy = ["Rich Industrial", "Average Industrial", "Poor Industrial", "Mainly Industrial",
 				"Mainly Agricultural", "Rich Agricultural", "Average Agricultural", "Poor Agricultural"][self.economy]
 		self.str_government = ["Anarchy", "Feudal", "Multi-gov", "Dictatorship",
 				"Communist", "Confederacy", "Democracy", "Corporate State"][self.government]
 		self.danger = [5, 3, 1, 1, 1, 0, 0, 0][self.government]
-		sp.set_seed(s)
+
+	@property
+	def description(self):
+		# Generating the description is slow and it is rarely needed.
+		if self._description is None:
+			self.sp.set_fastseed(*self.fastseed)
+			self._description = self.sp.make_goatsoup("\x8F is \x97.", self)
+		return self._description
 
 	def __repr__(self):
 		s = f'Economy: {self.str_economy}\nGovernment: {self.str_government}\n' + \
@@ -191,51 +200,251 @@ class System:
 				f'{self.description}\n'
 		return s
 
+# Square cells over a set of points, to find the points in an area without
+# looking at all of them.
+class SpatialGrid:
+	def __init__(self, points, cellsize=16):
+		self.points = points
+		self.cellsize = cellsize
+		self.cells = {}
+		for i, (x, y) in enumerate(points):
+			self.cells.setdefault((x // cellsize, y // cellsize), []).append(i)
+		cx = [c[0] for c in self.cells]
+		cy = [c[1] for c in self.cells]
+		self.cmin = min(cx + [0]), min(cy + [0])
+		self.cmax = max(cx + [0]), max(cy + [0])
+
+	def _cells(self, x0, y0, x1, y1):
+		cs = self.cellsize
+		for cx in range(floor(x0) // cs, floor(x1) // cs + 1):
+			for cy in range(floor(y0) // cs, floor(y1) // cs + 1):
+				yield self.cells.get((cx, cy), ())
+
+	def query_rect(self, x0, y0, x1, y1):
+		# Indices of all points with x0 <= x <= x1 and y0 <= y <= y1, in
+		# ascending order.
+		ret = []
+		pts = self.points
+		for cell in self._cells(x0, y0, x1, y1):
+			for i in cell:
+				x, y = pts[i]
+				if x0 <= x <= x1 and y0 <= y <= y1:
+					ret.append(i)
+		ret.sort()
+		return ret
+
+	def nearest(self, x, y):
+		# Index of the point closest to (x, y). Rings of cells are searched
+		# around the cell of (x, y) until no closer point can be found.
+		cs = self.cellsize
+		cx = floor(x) // cs
+		cy = floor(y) // cs
+		pts = self.points
+		best = None
+		bestd = None
+		r = 0
+		while True:
+			for i in range(cx - r, cx + r + 1):
+				for j in range(cy - r, cy + r + 1):
+					if max(abs(i - cx), abs(j - cy)) != r:
+						continue
+					for k in self.cells.get((i, j), ()):
+						px, py = pts[k]
+						d = (px - x) ** 2 + (py - y) ** 2
+						if bestd is None or d < bestd or (d == bestd and k < best):
+							best = k
+							bestd = d
+			if bestd is not None and bestd <= (r * cs) ** 2:
+				return best
+			if cx - r <= self.cmin[0] and cy - r <= self.cmin[1] and \
+					cx + r >= self.cmax[0] and cy + r >= self.cmax[1]:
+				return best
+			r += 1
+
+# The 256 systems of a galaxy. Only the seeds are computed up front, each
+# System is generated on first access.
+class Galaxy:
+	def __init__(self, sp, index, seed):
+		self.sp = sp
+		self.index = index
+		self.seeds = []
+		s = list(seed)
+		for i in range(256):
+			self.seeds.append(tuple(s))
+			for j in range(4): # Same as get_name() does
+				s = sp.tweak(s)
+		self.systems = [None] * 256
+		self.names = None
+		self.distances = None
+		self.coords = [(s[1] >> 8, s[0] >> 8) for s in self.seeds]
+		self.grid = SpatialGrid(self.coords)
+
+	def __len__(self):
+		return 256
+
+	def __getitem__(self, idx):
+		syst = self.systems[idx]
+		if syst is None:
+			syst = self.systems[idx] = System(self.sp, self.index, idx, self.seeds[idx])
+		return syst
+
+	def __iter__(self):
+		for i in range(256):
+			yield self[i]
+
+	def get_names(self):
+		# Names of all systems, without generating them.
+		if self.names is None:
+			self.names = [self.sp.get_name(list(s)).lower().capitalize() for s in self.seeds]
+		return self.names
+
+# Prefix tree over lower case system names, for incremental search.
+class NameTrie:
+	def __init__(self):
+		self.root = {}
+
+	def add(self, name, value):
+		node = self.root
+		for c in name:
+			node = node.setdefault(c, {})
+		node.setdefault(None, []).append(value)
+
+	def find(self, prefix):
+		# All values of names starting with prefix, sorted
+		node = self.root
+		for c in prefix:
+			node = node.get(c)
+			if node is None:
+				return []
+		ret = []
+		stack = [node]
+		while stack:
+			n = stack.pop()
+			for k, v in n.items():
+				if k is None:
+					ret.extend(v)
+				else:
+					stack.append(v)
+		ret.sort()
+		return ret
+
 class Universe:
 	def __init__(self):
 		self.seed = [0x5a4a, 0x0248, 0xb753]
 		self.base = [s for s in self.seed] # Make copy
 		self.sp = SeedProcessor(self.seed)
 		self.galaxies = []
+		sg = self.sp.copy_seed()
 		for j in range(8):
-			sg = self.sp.copy_seed()
-			sl = []
-			for i in range(256):
-				syst = System(self.sp, j, i)
-				sl.append(syst)
-			self.galaxies.append(sl)
-			self.sp.set_seed(self.sp.next_galaxy(sg))
+			self.galaxies.append(Galaxy(self.sp, j, sg))
+			sg = self.sp.next_galaxy(sg)
+		self.names = None
+		self.trie = None
+
+	def build_name_index(self):
+		# Lower case name to (galaxy, index), and a prefix tree of the names.
+		# The first system wins if a name appears more than once.
+		if self.names is not None:
+			return
+		self.names = {}
+		self.trie = NameTrie()
+		for g in self.galaxies:
+			for i, name in enumerate(g.get_names()):
+				key = name.lower()
+				self.names.setdefault(key, (g.index, i))
+				self.trie.add(key, (g.index, i))
 
 	def get_system_by_index(self, galaxy, idx):
 		return self.galaxies[galaxy][idx]
 
+	def get_coords(self, galaxy):
+		# Chart coordinates of all systems, without generating them.
+		return self.galaxies[galaxy].coords
+
+	def get_indices_in_rect(self, galaxy, x0, y0, x1, y1):
+		return self.galaxies[galaxy].grid.query_rect(x0, y0, x1, y1)
+
+	def get_systems_in_rect(self, galaxy, x0, y0, x1, y1):
+		g = self.galaxies[galaxy]
+		return [g[i] for i in g.grid.query_rect(x0, y0, x1, y1)]
+
+	def get_nearest_system(self, galaxy, x, y):
+		g = self.galaxies[galaxy]
+		return g[g.grid.nearest(x, y)]
+
 	def get_system_near(self, galaxy, x, y):
+		# Closest system less than 2 units away in both directions
 		g = self.galaxies[galaxy]
 		x0 = x - 2
 		x1 = x + 2
 		y0 = y - 2
 		y1 = y + 2
-		for s in g:
-			if x0 < s.x < x1 and y0 < s.y < y1:
-				return s
-		return None
+		best = None
+		for i in g.grid.query_rect(x0, y0, x1, y1):
+			sx, sy = g.coords[i]
+			if x0 < sx < x1 and y0 < sy < y1:
+				d = (sx - x) ** 2 + (sy - y) ** 2
+				if best is None or d < bestd:
+					best = i
+					bestd = d
+		if best is None:
+			return None
+		return g[best]
 
 	def get_distance_by_index(self, galaxy, idx0, idx1):
-		s0 = self.galaxies[galaxy][idx0]
-		s1 = self.galaxies[galaxy][idx1]
-		dx = (s0.x - s1.x) * 4
-		dy = (s0.y - s1.y) * 2
+		c = self.galaxies[galaxy].coords
+		x0, y0 = c[idx0]
+		x1, y1 = c[idx1]
+		dx = (x0 - x1) * 4
+		dy = (y0 - y1) * 2
 		d = sqrt(dx*dx + dy*dy) / 10.0 # Light years
 		return d
 
+	def get_distance_matrix(self, galaxy):
+		# Distances between all systems of a galaxy in light years, as a
+		# flat 256x256 array of floats, row by row. Computed on first use.
+		g = self.galaxies[galaxy]
+		if g.distances is None:
+			pts = [(x * 4, y * 2) for x, y in g.coords]
+			m = array('f')
+			for x0, y0 in pts:
+				m.extend([sqrt((x0 - x1)**2 + (y0 - y1)**2) / 10.0 for x1, y1 in pts])
+			g.distances = m
+		return g.distances
+
+	def get_reachable(self, galaxy, idx, maxdist):
+		# Indices of all other systems at most maxdist light years away
+		m = self.get_distance_matrix(galaxy)
+		maxdist = array('f', [maxdist])[0] # Round like the matrix
+		row = m[idx * 256:(idx + 1) * 256]
+		return [i for i, d in enumerate(row) if d <= maxdist and i != idx]
+
+	def get_within_jumps(self, galaxy, idx, njumps, maxjump=7.0):
+		# Systems that can be reached with at most njumps jumps of maxjump
+		# light years each, mapped to the number of jumps needed.
+		ret = {idx: 0}
+		front = [idx]
+		for n in range(1, njumps + 1):
+			nxt = []
+			for i in front:
+				for j in self.get_reachable(galaxy, i, maxjump):
+					if j not in ret:
+						ret[j] = n
+						nxt.append(j)
+			front = nxt
+		return ret
+
 	def get_system_by_name(self, name):
-		for j in range(8):
-			g = self.galaxies[j]
-			for i in range(256):
-				s = g[i]
-				if name == s.name:
-					return j,i
-		return None
+		self.build_name_index()
+		return self.names.get(name.lower(), None)
+
+	def find_systems(self, prefix, galaxy=None):
+		# (galaxy, index) of all systems whose name starts with prefix
+		self.build_name_index()
+		ret = self.trie.find(prefix.lower())
+		if galaxy is not None:
+			ret = [r for r in ret if r[0] == galaxy]
+		return ret
 
 	def test(self):
 		g0 = self.galaxies[0]